@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Compare branch extraction engines on a saved kargolojik.com page.
+
+Checks that every engine returns the same fields as the original
+BeautifulSoup implementation and reports per-page parse time:
+
+    python benchmarks/bench_extraction.py [--iterations 200] [--fixture PATH]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from extractor import EXTRACTORS  # noqa: E402
+
+FIXTURE = Path(__file__).parent / 'fixtures' / 'branch_page.html'
+URL = 'https://kargolojik.com/ptt-kargo-kadikoy-subesi/'
+
+
+def time_engine(extract, html: str, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        extract(html, URL)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--fixture', type=Path, default=FIXTURE)
+    args = parser.parse_args()
+
+    html = args.fixture.read_text(encoding='utf-8')
+    baseline = EXTRACTORS['bs4'](html, URL)
+    print(f"Fixture: {args.fixture.name} ({len(html) / 1024:.1f} KiB), {args.iterations} iterations")
+    print(f"Baseline output: {baseline}")
+
+    results = {}
+    for name, extract in EXTRACTORS.items():
+        output = extract(html, URL)
+        if output != baseline:
+            diff = {k: (baseline[k], output.get(k)) for k in baseline if baseline[k] != output.get(k)}
+            print(f"{name}: OUTPUT MISMATCH {diff}")
+        results[name] = time_engine(extract, html, args.iterations)
+
+    base_time = results['bs4']
+    for name, seconds in sorted(results.items(), key=lambda item: item[1]):
+        print(f"{name:>6}: {seconds * 1000:8.3f} ms/page  {1 / seconds:8.1f} pages/s  {base_time / seconds:5.1f}x vs bs4")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Latency and typo recall of branch search on a synthetic corpus.
+
+Builds a BranchIndex over generated branches, then runs queries made from
+real branch names, once as typed and once with a single typo (swap, drop,
+double or replace a letter in one word). Reports per-query latency for the
+substring search and the ranked mode, how many typo queries still find
+anything, and recall@k of the ranked typo results against the ranked
+results of the clean query:
+
+    python benchmarks/bench_search.py [--branches 100000] [--queries 300] [--k 20]
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from branch_index import BranchIndex  # noqa: E402
+from search_keys import normalize_text  # noqa: E402
+
+COMPANIES = ['PTT Kargo', 'Yurtiçi Kargo', 'Aras Kargo', 'MNG Kargo', 'Sürat Kargo',
+             'UPS Kargo', 'DHL Express', 'Kolay Gelsin', 'HepsiJet', 'Trendyol Express']
+CITIES = {
+    'İstanbul': ['Kadıköy', 'Üsküdar', 'Beşiktaş', 'Şişli', 'Bakırköy', 'Ataşehir', 'Pendik', 'Esenyurt'],
+    'Ankara': ['Çankaya', 'Keçiören', 'Yenimahalle', 'Mamak', 'Etimesgut'],
+    'İzmir': ['Karşıyaka', 'Konak', 'Bornova', 'Buca', 'Çiğli'],
+    'Bursa': ['Osmangazi', 'Nilüfer', 'Yıldırım', 'İnegöl'],
+    'Antalya': ['Muratpaşa', 'Kepez', 'Konyaaltı', 'Alanya', 'Manavgat'],
+    'Muğla': ['Milas', 'Bodrum', 'Fethiye', 'Marmaris', 'Menteşe'],
+    'Trabzon': ['Ortahisar', 'Akçaabat', 'Of'],
+    'Konya': ['Selçuklu', 'Meram', 'Karatay'],
+    'Gaziantep': ['Şahinbey', 'Şehitkamil'],
+    'Eskişehir': ['Odunpazarı', 'Tepebaşı'],
+}
+NEIGHBOURHOODS = ['Cumhuriyet', 'Atatürk', 'Fatih', 'Yeni', 'Merkez', 'Gazi', 'İstiklal', 'Hürriyet',
+                  'Barbaros', 'Mimar Sinan', 'Fevzi Çakmak', 'Yunus Emre', 'Zafer', 'Bahçelievler',
+                  'Güzelyalı', 'Çamlık', 'Kocatepe', 'Sanayi', 'Esentepe', 'Karşıyaka']
+STREETS = ['İnönü', 'Gazi Mustafa Kemal', 'Cumhuriyet', 'Adnan Menderes', 'Kazım Karabekir',
+           'Ziya Gökalp', 'Millet', 'Hastane', 'Okul', 'Çarşı', 'Lale', 'Menekşe', 'Papatya']
+
+
+def make_corpus(count: int, rng: random.Random) -> list:
+    docs = []
+    for i in range(count):
+        company = rng.choice(COMPANIES)
+        city = rng.choice(list(CITIES))
+        district = rng.choice(CITIES[city])
+        neighbourhood = rng.choice(NEIGHBOURHOODS)
+        docs.append({
+            "_id": f"{i:08d}",
+            "name": f"{company} {district} {neighbourhood} Şubesi",
+            "company": company,
+            "city": city,
+            "district": district,
+            "address": f"{neighbourhood} Mah. {rng.choice(STREETS)} Cad. No:{rng.randint(1, 250)} {district}/{city}",
+        })
+    return docs
+
+
+def add_typo(word: str, rng: random.Random) -> str:
+    i = rng.randrange(len(word) - 1)
+    kind = rng.choice(('swap', 'drop', 'double', 'replace'))
+    if kind == 'swap':
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    if kind == 'drop':
+        return word[:i] + word[i + 1:]
+    if kind == 'double':
+        return word[:i] + word[i] + word[i:]
+    return word[:i] + rng.choice('aeiklmnorstuy'.replace(word[i], '')) + word[i + 1:]
+
+
+def make_queries(docs: list, count: int, rng: random.Random) -> list:
+    """(clean words, typo words) pairs built from branch names"""
+    queries = []
+    while len(queries) < count:
+        doc = rng.choice(docs)
+        words = normalize_text(doc['name']).split()[:-1]   # drop "subesi"
+        words = rng.sample(words, min(len(words), rng.choice((1, 2, 3))))
+        typo_at = [i for i, w in enumerate(words) if len(w) >= 4]
+        if not typo_at:
+            continue
+        i = rng.choice(typo_at)
+        typo = list(words)
+        typo[i] = add_typo(words[i], rng)
+        queries.append((words, typo))
+    return queries
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def summary(label: str, millis: list) -> str:
+    millis = sorted(millis)
+    p95 = millis[int(len(millis) * 0.95) - 1]
+    return f"{label:>16}: p50 {statistics.median(millis):7.2f} ms  p95 {p95:7.2f} ms  max {millis[-1]:7.2f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--branches', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    docs = make_corpus(args.branches, rng)
+    index, build_ms = timed(lambda: BranchIndex(docs))
+    print(f"Indexed {len(index)} branches in {build_ms / 1000:.1f} s")
+
+    latency = {'substring': [], 'substring typo': [], 'ranked': [], 'ranked typo': []}
+    found = {'substring': 0, 'ranked': 0}
+    recall = []
+    for clean, typo in make_queries(docs, args.queries, rng):
+        _, ms = timed(lambda: index.search(clean, limit=args.k))
+        latency['substring'].append(ms)
+        (typo_page, _), ms = timed(lambda: index.search(typo, limit=args.k))
+        latency['substring typo'].append(ms)
+        found['substring'] += bool(typo_page)
+
+        (expected, _), ms = timed(lambda: index.ranked(clean, limit=args.k))
+        latency['ranked'].append(ms)
+        (results, _), ms = timed(lambda: index.ranked(typo, limit=args.k))
+        latency['ranked typo'].append(ms)
+        found['ranked'] += bool(results)
+        if expected:
+            got = {id(doc) for doc in results}
+            recall.append(sum(id(doc) in got for doc in expected) / len(expected))
+
+    print(f"{args.queries} queries, top {args.k}")
+    for label, millis in latency.items():
+        print(summary(label, millis))
+    for label, hits in found.items():
+        print(f"{label:>16}: {hits / args.queries:6.1%} of typo queries return results")
+    print(f"{'ranked':>16}: recall@{args.k} of typo vs clean query {statistics.mean(recall):6.1%}")
+
+
+if __name__ == '__main__':
+    main()
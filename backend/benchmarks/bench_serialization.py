@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Compare branch list serialization paths at the maximum page size.
+
+The model path is what /api/branches used to do per request: build a
+Branch per row, validate the BranchSearchResponse against the route's
+response_model and render it with the json module. The fast path builds
+the aliased rows directly and encodes them with orjson. Both must produce
+the same JSON document, or the script exits with status 1:
+
+    python benchmarks/bench_serialization.py [--iterations 2000] [--limit 100]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# server.py reads these at import time; no connection is made
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'bench')
+
+import orjson  # noqa: E402
+from bson import ObjectId  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from server import BRANCH_LIST_PROJECTION, Branch, BranchSearchResponse, branch_list_row  # noqa: E402
+
+COMPANIES = ['PTT Kargo', 'Yurtiçi Kargo', 'Aras Kargo', 'MNG Kargo', 'Sürat Kargo']
+CITIES = [('İstanbul', 'Kadıköy'), ('Ankara', 'Çankaya'), ('İzmir', 'Karşıyaka'), ('Muğla', 'Milas')]
+
+
+def sample_docs(count: int) -> list:
+    created = datetime(2024, 5, 1, 12, 30, 15, 250000)
+    docs = []
+    for i in range(count):
+        company = COMPANIES[i % len(COMPANIES)]
+        city, district = CITIES[i % len(CITIES)]
+        docs.append({
+            "_id": ObjectId(),
+            "id": f"branch-{i}",
+            "name": f"{company} {district} Şubesi {i}",
+            "company": company,
+            "city": city,
+            "district": district,
+            "address": f"Atatürk Cad. No:{i} {district}/{city}",
+            "phone": f"0212 555 {i % 100:02d} {i % 97:02d}",
+            "google_maps_url": f"https://www.google.com/maps?q={city}+{district}",
+            "logo_url": "https://kargolojik.com/logo.png",
+            "created_at": created + timedelta(minutes=i)
+        })
+    return docs
+
+
+def model_path(docs: list, adapter: TypeAdapter) -> bytes:
+    response = BranchSearchResponse(
+        branches=[Branch(**{**b, "id": str(b.get("_id", b.get("id")))}) for b in docs],
+        total=1000,
+        page=1,
+        limit=len(docs),
+        next_cursor=None
+    )
+    content = adapter.dump_python(adapter.validate_python(response), mode='json', by_alias=True)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+
+def fast_path(docs: list) -> bytes:
+    return orjson.dumps({
+        "branches": [branch_list_row(b) for b in docs],
+        "total": 1000,
+        "page": 1,
+        "limit": len(docs),
+        "next_cursor": None
+    })
+
+
+def time_path(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    docs = sample_docs(args.limit)
+    # The fast path only ever sees projected documents
+    projected = [{k: v for k, v in doc.items() if k == '_id' or k in BRANCH_LIST_PROJECTION} for doc in docs]
+    adapter = TypeAdapter(BranchSearchResponse)
+
+    expected = json.loads(model_path(docs, adapter))
+    # /api/branches only sends facets when they were asked for
+    if expected.get('facets') is None:
+        expected.pop('facets', None)
+    for row in expected['branches']:
+        row['working_hours'] = {}
+        row['source_url'] = ""
+    if json.loads(fast_path(projected)) != expected:
+        print("fast path: OUTPUT MISMATCH")
+        sys.exit(1)
+
+    results = {
+        'model': time_path(lambda: model_path(docs, adapter), args.iterations),
+        'fast': time_path(lambda: fast_path(projected), args.iterations),
+    }
+    print(f"{args.limit} branches per response, {args.iterations} iterations")
+    base_time = results['model']
+    for name, seconds in results.items():
+        print(f"{name:>6}: {seconds * 1000:8.3f} ms/response  {1 / seconds:8.1f} responses/s  {base_time / seconds:5.1f}x vs model")
+
+
+if __name__ == '__main__':
+    main()
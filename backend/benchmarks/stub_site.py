@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for kargolojik.com used to exercise the crawler offline.
+
+Serves post-sitemap1..7.xml listing synthetic branch pages whose markup
+mimics the real site (h1 title, 📍/🏠/📞 lines, maps link, logo). Pages
+carry ETag/Last-Modified and answer conditional GETs with 304, so
+incremental crawls can be exercised too:
+
+    python benchmarks/stub_site.py --pages 5000 --port 8765
+    python crawler.py --base-url http://127.0.0.1:8765 --rate 0
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SITEMAP_COUNT = 7
+COMPANIES = ['PTT Kargo', 'Yurtiçi Kargo', 'Aras Kargo', 'Sürat Kargo', 'UPS Kargo', 'DHL Kargo']
+LOCATIONS = [('İstanbul', 'Kadıköy'), ('Ankara', 'Çankaya'), ('İzmir', 'Konak'),
+             ('Bursa', 'Osmangazi'), ('Antalya', 'Muratpaşa'), ('Trabzon', 'Ortahisar')]
+LASTMOD = '2026-01-15T10:00:00+00:00'
+LAST_MODIFIED = 'Thu, 15 Jan 2026 10:00:00 GMT'
+
+
+def branch_slug(i: int) -> str:
+    company = COMPANIES[i % len(COMPANIES)].split()[0].lower().replace('ç', 'c').replace('ü', 'u')
+    return f"{company}-kargo-sube-{i}-subesi"
+
+
+def branch_page(i: int) -> str:
+    company = COMPANIES[i % len(COMPANIES)]
+    city, district = LOCATIONS[i % len(LOCATIONS)]
+    filler = '<p>Kargo gönderilerinizi bu şubeden yapabilirsiniz.</p>' * 40
+    return f"""<!DOCTYPE html>
+<html><head><title>{company} {district} Şubesi</title></head>
+<body>
+<header><img src="/wp-content/uploads/{company.split()[0].lower()}-logo.png" alt="logo"></header>
+<article>
+<h1>{company} {district} {i} Şubesi</h1>
+{filler}
+<p>📍 Konum: {city} / {district}
+</p>
+<p>🏠 Adres: Örnek Mah. Cumhuriyet Cad. No: {i}</p>
+<p>📞 Telefon: 0 212 555 {i % 10000:04d}</p>
+<a href="https://www.google.com/maps/search/?api=1&query={company.replace(' ', '+')}+{i}">Yol tarifi</a>
+{filler}
+</article>
+</body></html>"""
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    pages = 1000
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: str, content_type: str, headers: dict = None):
+        payload = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path.startswith('/post-sitemap') and path.endswith('.xml'):
+            index = int(path[len('/post-sitemap'):-len('.xml')])
+            host = self.headers.get('Host')
+            urls = ''.join(
+                f"<url><loc>http://{host}/{branch_slug(i)}/</loc><lastmod>{LASTMOD}</lastmod></url>"
+                for i in range(self.pages) if i % SITEMAP_COUNT == index - 1
+            )
+            body = f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+            return self._send(200, body, 'application/xml')
+        slug = path.strip('/')
+        if slug.endswith('-subesi'):
+            i = int(slug.split('-')[-2])
+            if i < self.pages:
+                validators = {'ETag': f'"branch-{i}-v1"', 'Last-Modified': LAST_MODIFIED}
+                if self.headers.get('If-None-Match') == validators['ETag']:
+                    return self._send(304, '', 'text/html; charset=utf-8', validators)
+                return self._send(200, branch_page(i), 'text/html; charset=utf-8', validators)
+        self._send(404, 'not found', 'text/plain')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic kargolojik.com for crawler testing")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pages', type=int, default=1000)
+    args = parser.parse_args()
+
+    StubHandler.pages = args.pages
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StubHandler)
+    print(f"Serving {args.pages} branch pages on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
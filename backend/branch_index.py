@@ -0,0 +1,423 @@
+"""
+In-memory inverted index over the branches collection.
+
+The index keeps every branch document in memory together with a trigram
+posting list per search field, so /api/branches can answer searches without
+any MongoDB round trip. Results are ordered by (normalized name, _id), the
+same stable key used for keyset cursors. Every search word must appear as a substring of at
+least one of name, address, city, district or company, and the optional
+city/company filters are substring matches on their own field. Both sides
+are compared after Turkish folding, so "kadikoy" matches "Kadıköy".
+
+``ranked`` is the relevance mode: BM25F over the same fields with name,
+company and district boosted over address. Each query token also matches
+vocabulary terms it is a prefix of and, for longer tokens, terms within a
+small edit distance, so "bakirkoyy" and "yurticii" still find Bakırköy and
+Yurtiçi. Typo candidates come from a trigram index over the vocabulary
+rather than a scan of it.
+benchmarks/bench_search.py measures latency and typo recall.
+"""
+
+import heapq
+import math
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+
+from search_keys import TOKEN_SPLIT, normalize_text
+
+SEARCH_FIELDS = ('name', 'address', 'city', 'district', 'company')
+CITY_FIELD = SEARCH_FIELDS.index('city')
+COMPANY_FIELD = SEARCH_FIELDS.index('company')
+
+GRAM_SIZE = 3
+TOTALS_CACHE_SIZE = 1024
+FACET_LIMIT = 100
+
+# Relevance ranking, in SEARCH_FIELDS order
+FIELD_BOOSTS = (3.0, 1.0, 1.5, 2.0, 2.0)
+BM25_K1 = 1.2
+BM25_B = 0.75
+PREFIX_MATCH_WEIGHT = 0.8
+MAX_PREFIX_EXPANSIONS = 50
+VOCAB_END = '\uffff'
+
+
+def _grams(text: str, size: int) -> set:
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _tokens(value: str) -> list:
+    return [t for t in TOKEN_SPLIT.split(value) if t]
+
+
+def _term_grams(term: str) -> set:
+    """Trigrams of a vocabulary term, padded so word edges count"""
+    return _grams(f' {term} ', 3)
+
+
+def max_edits(term: str) -> int:
+    """Typos tolerated in a query token of this length"""
+    if len(term) < 3 or term.isdigit():
+        return 0
+    return 1 if len(term) < 8 else 2
+
+
+def edit_distance(a: str, b: str, bound: int) -> int:
+    """Edit distance counting adjacent swaps as one edit, capped at bound + 1"""
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, before[j - 2] + 1)
+            current[j] = value
+        if min(current) > bound:
+            return bound + 1
+        before, previous = previous, current
+    return min(previous[-1], bound + 1)
+
+
+def _doc_key(doc: dict) -> str:
+    return str(doc.get('_id', doc.get('id')))
+
+
+def sort_key(doc: dict) -> tuple:
+    """Stable listing order: normalized name, then document key"""
+    return (normalize_text(doc.get('name')), _doc_key(doc))
+
+
+class BranchIndex:
+    """Trigram inverted index with keyset pagination"""
+
+    def __init__(self, docs=()):
+        self._docs = []                     # position -> document (None if removed)
+        self._fields = []                   # position -> tuple of folded fields
+        self._sort_keys = []                # position -> sort_key(document)
+        self._positions = {}                # document key -> position
+        self._postings = defaultdict(set)   # gram -> positions
+        self._order = None                  # live positions by sort key, built lazily
+        self._totals = {}                   # query -> cached match count
+        self._alive = 0
+        self._terms = {}                    # term -> {position: BM25F term weight}
+        self._vocab_grams = defaultdict(set)  # trigram -> terms, for typo lookups
+        self._vocab = None                  # sorted terms, built lazily
+        self._avg_lens = None               # mean tokens per field, fixed after the first build
+        for doc in docs:
+            self.upsert(doc)
+        lens = [0] * len(SEARCH_FIELDS)
+        for fields in self._fields:
+            for f, value in enumerate(fields):
+                lens[f] += len(_tokens(value))
+        self._avg_lens = tuple(max(n / max(self._alive, 1), 1.0) for n in lens)
+        for pos, doc in enumerate(self._docs):
+            if doc is not None:
+                self._link_terms(pos, self._fields[pos])
+
+    def __len__(self):
+        return self._alive
+
+    def _index_grams(self, fields: tuple) -> set:
+        grams = set()
+        for value in fields:
+            for size in range(2, GRAM_SIZE + 1):
+                grams |= _grams(value, size)
+        return grams
+
+    def _unlink(self, pos: int):
+        for gram in self._index_grams(self._fields[pos]):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(pos)
+                if not postings:
+                    del self._postings[gram]
+        if self._avg_lens is None:
+            return
+        for term in self._term_weights(self._fields[pos]):
+            postings = self._terms.get(term)
+            if postings is None:
+                continue
+            postings.pop(pos, None)
+            if not postings:
+                del self._terms[term]
+                for gram in _term_grams(term):
+                    self._vocab_grams[gram].discard(term)
+                self._vocab = None
+
+    def _term_weights(self, fields: tuple) -> dict:
+        """BM25F weight of every term in a document, before IDF"""
+        tf = defaultdict(float)
+        for f, value in enumerate(fields):
+            tokens = _tokens(value)
+            if not tokens:
+                continue
+            weight = FIELD_BOOSTS[f] / (1 - BM25_B + BM25_B * len(tokens) / self._avg_lens[f])
+            for token in tokens:
+                tf[token] += weight
+        return {term: freq * (BM25_K1 + 1) / (freq + BM25_K1) for term, freq in tf.items()}
+
+    def _link_terms(self, pos: int, fields: tuple):
+        for term, weight in self._term_weights(fields).items():
+            postings = self._terms.get(term)
+            if postings is None:
+                postings = self._terms[term] = {}
+                if not term.isdigit():
+                    for gram in _term_grams(term):
+                        self._vocab_grams[gram].add(term)
+                self._vocab = None
+            postings[pos] = weight
+
+    def upsert(self, doc: dict):
+        """Add a document or replace the indexed copy with the same key"""
+        key = _doc_key(doc)
+        fields = tuple(normalize_text(doc.get(f)) for f in SEARCH_FIELDS)
+        pos = self._positions.get(key)
+        if pos is None:
+            pos = len(self._docs)
+            self._docs.append(doc)
+            self._fields.append(fields)
+            self._sort_keys.append(sort_key(doc))
+            self._positions[key] = pos
+            self._alive += 1
+        else:
+            self._unlink(pos)
+            self._docs[pos] = doc
+            self._fields[pos] = fields
+            self._sort_keys[pos] = sort_key(doc)
+        for gram in self._index_grams(fields):
+            self._postings[gram].add(pos)
+        if self._avg_lens is not None:
+            self._link_terms(pos, fields)
+        self._order = None
+        self._totals.clear()
+
+    def distinct(self, field: str) -> list:
+        """Sorted non-empty values of a field, like Collection.distinct"""
+        return sorted({doc.get(field) for doc in self._docs if doc is not None and doc.get(field)})
+
+    def _ordered(self) -> list:
+        if self._order is None:
+            live = [pos for pos, doc in enumerate(self._docs) if doc is not None]
+            self._order = sorted(live, key=self._sort_keys.__getitem__)
+        return self._order
+
+    def _candidates(self, terms: list):
+        """Intersect posting lists for all terms long enough to have grams"""
+        result = None
+        for term in terms:
+            size = min(len(term), GRAM_SIZE)
+            if size < 2:
+                continue
+            for gram in sorted(_grams(term, size)):
+                postings = self._postings.get(gram)
+                if not postings:
+                    return set()
+                result = set(postings) if result is None else result & postings
+                if not result:
+                    return result
+        return result
+
+    def _query(self, words: list, city: str, company: str):
+        """Return (ordered positions to scan, match predicate) for a query"""
+        words = [normalize_text(w) for w in words if w]
+        city = normalize_text(city)
+        company = normalize_text(company)
+
+        candidates = self._candidates(words + [t for t in (city, company) if t])
+
+        def matches(pos: int) -> bool:
+            if candidates is not None and pos not in candidates:
+                return False
+            fields = self._fields[pos]
+            if city and city not in fields[CITY_FIELD]:
+                return False
+            if company and company not in fields[COMPANY_FIELD]:
+                return False
+            return all(any(w in f for f in fields) for w in words)
+
+        # Small candidate sets are cheaper to sort than to find in the full order
+        if candidates is None or len(candidates) * 8 > self._alive:
+            return self._ordered(), matches
+        return sorted(candidates, key=self._sort_keys.__getitem__), matches
+
+    def count(self, words: list, city: str = None, company: str = None) -> int:
+        """Number of matches for a query, cached until the index changes"""
+        cache_key = (tuple(normalize_text(w) for w in words), normalize_text(city), normalize_text(company))
+        total = self._totals.get(cache_key)
+        if total is None:
+            positions, matches = self._query(words, city, company)
+            total = sum(1 for pos in positions if matches(pos))
+            if len(self._totals) >= TOTALS_CACHE_SIZE:
+                self._totals.clear()
+            self._totals[cache_key] = total
+        return total
+
+    def search(self, words: list, city: str = None, company: str = None,
+               skip: int = 0, limit: int = 20, after: tuple = None):
+        """Return (documents, next sort key or None) for one page of matches
+
+        ``after`` is the sort key of the last document on the previous page;
+        scanning starts right after it, so deep pages cost the same as page 1.
+        """
+        positions, matches = self._query(words, city, company)
+        start = 0
+        if after is not None:
+            start = bisect_right(positions, tuple(after), key=self._sort_keys.__getitem__)
+
+        page = []
+        last = None
+        skipped = 0
+        for i in range(start, len(positions)):
+            pos = positions[i]
+            if self._docs[pos] is None or not matches(pos):
+                continue
+            if skipped < skip:
+                skipped += 1
+                continue
+            if len(page) == limit:
+                return page, self._sort_keys[last]
+            page.append(self._docs[pos])
+            last = pos
+        return page, None
+
+    def matching(self, words: list, city: str = None, company: str = None):
+        """Iterate over every match of a query in listing order"""
+        positions, matches = self._query(words, city, company)
+        return (self._docs[pos] for pos in positions if self._docs[pos] is not None and matches(pos))
+
+    def _vocabulary(self) -> list:
+        if self._vocab is None:
+            self._vocab = sorted(self._terms)
+        return self._vocab
+
+    def _expand(self, token: str) -> dict:
+        """Vocabulary terms a query token may stand for, with a match weight"""
+        expansions = {}
+        if token in self._terms:
+            expansions[token] = 1.0
+
+        vocab = self._vocabulary()
+        lo = bisect_left(vocab, token)
+        hi = bisect_left(vocab, token + VOCAB_END, lo)
+        longer = [term for term in vocab[lo:hi] if term != token]
+        if len(longer) > MAX_PREFIX_EXPANSIONS:
+            longer = heapq.nlargest(MAX_PREFIX_EXPANSIONS, longer, key=lambda t: len(self._terms[t]))
+        for term in longer:
+            expansions[term] = PREFIX_MATCH_WEIGHT
+
+        bound = max_edits(token)
+        if bound:
+            grams = _term_grams(token)
+            shared = defaultdict(int)
+            for gram in grams:
+                for term in self._vocab_grams.get(gram, ()):
+                    shared[term] += 1
+            # An edit changes at most four trigrams (a swap does)
+            needed = len(grams) - 4 * bound
+            for term, count in shared.items():
+                if count >= needed and term not in expansions:
+                    distance = edit_distance(token, term, bound)
+                    if distance <= bound:
+                        expansions[term] = 1.0 / (1 + distance)
+        return expansions
+
+    def _ranked_scores(self, tokens: list, city: str, company: str) -> dict:
+        """Relevance score of every position matching all tokens and filters"""
+        # Rarest token first; later tokens only score the surviving positions
+        weighted = []
+        for token in tokens:
+            terms = []
+            for term, factor in self._expand(token).items():
+                postings = self._terms[term]
+                idf = math.log(1 + (self._alive - len(postings) + 0.5) / (len(postings) + 0.5))
+                terms.append((factor * idf, postings))
+            if not terms:
+                return {}
+            weighted.append((sum(len(postings) for _, postings in terms), terms))
+        weighted.sort(key=lambda item: item[0])
+
+        scores = None
+        for size, terms in weighted:
+            best = {}
+            if scores is None or size < len(scores) * len(terms):
+                for boost, postings in terms:
+                    for pos, weight in postings.items():
+                        score = boost * weight
+                        if score > best.get(pos, 0.0):
+                            best[pos] = score
+                if scores is not None:
+                    best = {pos: score + best[pos] for pos, score in scores.items() if pos in best}
+            else:
+                for pos, score in scores.items():
+                    top = 0.0
+                    for boost, postings in terms:
+                        weight = postings.get(pos)
+                        if weight is not None and boost * weight > top:
+                            top = boost * weight
+                    if top:
+                        best[pos] = score + top
+            scores = best
+            if not scores:
+                return {}
+
+        if city or company:
+            fields = self._fields
+            scores = {
+                pos: score for pos, score in scores.items()
+                if city in fields[pos][CITY_FIELD] and company in fields[pos][COMPANY_FIELD]
+            }
+        return scores
+
+    def ranked(self, words: list, city: str = None, company: str = None,
+               skip: int = 0, limit: int = 20):
+        """Return (documents, total matches) ordered by relevance
+
+        Every query token has to match some field, exactly, as a prefix or
+        within max_edits typos; the city/company filters stay substring
+        matches. Ties keep the listing order.
+        """
+        tokens = list(dict.fromkeys(t for w in words for t in _tokens(normalize_text(w))))
+        if not tokens:
+            return self.search([], city, company, skip, limit)[0], self.count([], city, company)
+
+        scores = self._ranked_scores(tokens, normalize_text(city), normalize_text(company))
+        top = heapq.nsmallest(skip + limit, scores, key=lambda pos: (-scores[pos], self._sort_keys[pos]))
+        return [self._docs[pos] for pos in top[skip:]], len(scores)
+
+    def facets(self, words: list, city: str = None, company: str = None, ranked: bool = False) -> dict:
+        """Company, city and district value counts over a query's matches"""
+        tokens = list(dict.fromkeys(t for w in words for t in _tokens(normalize_text(w))))
+        if ranked and tokens:
+            positions = self._ranked_scores(tokens, normalize_text(city), normalize_text(company))
+        else:
+            ordered, matches = self._query(words, city, company)
+            positions = (pos for pos in ordered if matches(pos))
+
+        companies = Counter()
+        cities = Counter()
+        districts = Counter()
+        for pos in positions:
+            doc = self._docs[pos]
+            doc_city = doc.get('city') or ''
+            if doc.get('company'):
+                companies[doc['company']] += 1
+            if doc_city:
+                cities[doc_city] += 1
+            if doc.get('district'):
+                districts[(doc_city, doc['district'])] += 1
+
+        def top(counter):
+            return sorted(counter.items(), key=lambda item: (-item[1], item[0]))[:FACET_LIMIT]
+
+        return {
+            "company": [{"value": value, "count": n} for value, n in top(companies)],
+            "city": [{"value": value, "count": n} for value, n in top(cities)],
+            "district": [
+                {"value": district, "city": district_city, "count": n}
+                for (district_city, district), n in top(districts)
+            ],
+        }
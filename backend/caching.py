@@ -0,0 +1,159 @@
+"""
+In-process caches for API responses.
+
+Values derived from the branches collection are tagged with the branches
+data version (see data_version.py) they were computed from, so a write
+anywhere invalidates them without any explicit purge. Static payloads are
+pre-serialized and pre-compressed once.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # optional: gzip-only without it
+    brotli = None
+
+
+def make_etag(payload) -> str:
+    """Strong ETag for a JSON-serializable payload"""
+    body = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode()
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+class VersionedCache:
+    """Values computed once per data version, together with their ETag"""
+
+    def __init__(self):
+        self._entries = {}  # name -> (version, value, etag)
+
+    async def get(self, name: str, version, compute):
+        """Return (value, etag), calling ``compute()`` if the version moved on"""
+        entry = self._entries.get(name)
+        if entry is not None and version is not None and entry[0] == version:
+            return entry[1], entry[2]
+        value = await compute()
+        etag = make_etag(value)
+        if version is not None:
+            self._entries[name] = (version, value, etag)
+        return value, etag
+
+    def clear(self):
+        self._entries.clear()
+
+
+class LRUCache:
+    """Bounded LRU cache with TTL and single-flight computation
+
+    Concurrent misses for the same key share one ``compute()`` call instead
+    of each hitting the database.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._inflight = {}             # key -> asyncio.Future
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get_or_compute(self, key, compute):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; keep the loop from warning about it
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(value)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return value
+        finally:
+            del self._inflight[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
+
+
+class StaticPayload:
+    """Immutable JSON body, serialized and compressed once
+
+    Each encoding gets its own strong ETag, as required for distinct
+    representations of the same resource.
+    """
+
+    def __init__(self, payload, brotli_quality: int = 11):
+        self.body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode()
+        digest = hashlib.sha1(self.body).hexdigest()
+        self.variants = {None: (self.body, f'"{digest}"')}
+        self.variants['gzip'] = (gzip.compress(self.body, compresslevel=9, mtime=0), f'"{digest}-gzip"')
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(self.body, quality=brotli_quality), f'"{digest}-br"')
+        self.etags = {etag for _, etag in self.variants.values()}
+
+    def select(self, accept_encoding: str = None):
+        """Return (encoding, body, etag) for the client's Accept-Encoding"""
+        accepted = set()
+        for part in (accept_encoding or '').split(','):
+            token, _, params = part.strip().partition(';')
+            if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                continue
+            accepted.add(token.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                return (encoding,) + self.variants[encoding]
+        return (None,) + self.variants[None]
+
+    def matches(self, if_none_match: str = None) -> bool:
+        """True if If-None-Match names any representation of this payload"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return bool(tags & self.etags)
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+Concurrent sitemap crawler for kargolojik.com branch pages.
+
+All seven post sitemaps are walked and every branch URL is streamed into a
+bounded pool of asyncio workers. Workers share one pooled HTTP client with
+keep-alive, are throttled per host (concurrency and request rate), retry
+transient failures with exponential backoff and flush parsed branches to
+MongoDB in batched, unordered bulk upserts.
+
+Crawls are incremental: per-URL state (sitemap lastmod, ETag, Last-Modified
+and a content hash) is kept in the crawl_state collection. URLs whose lastmod
+has not moved are skipped outright, the rest are fetched with conditional
+headers, and a page is only re-parsed and upserted when its content changed.
+
+With a PageStore every fetched page is also kept on disk under its content
+hash, and ``--reparse`` re-runs extraction over the stored pages instead of
+crawling, so extraction changes can be applied without touching the site.
+
+The base URL is configurable, so the whole pipeline can be pointed at a local
+stub server (see benchmarks/stub_site.py):
+
+    python crawler.py --base-url http://127.0.0.1:8765
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import hashlib
+import os
+import random
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import httpx
+from pymongo import UpdateOne
+
+from data_version import write_version
+from extractor import EXTRACTORS, ExtractorPool
+from geo import location_fields
+from page_store import PAGE_STORE_DIR, PageStore
+from phones import phone_fields
+from search_keys import search_keys
+
+CRAWL_BASE_URL = os.environ.get('CRAWL_BASE_URL', 'https://kargolojik.com')
+SITEMAP_COUNT = 7
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+USER_AGENT = 'kargolojik-crawler/1.0'
+# Fields of an imported branch that its sheet, not its page, decides
+SHEET_FIELDS = ('name', 'company', 'city', 'district')
+
+
+def sitemap_url(base_url: str, index: int) -> str:
+    return f"{base_url.rstrip('/')}/post-sitemap{index}.xml"
+
+
+def parse_sitemap(xml_text: str) -> list:
+    """Return (url, lastmod) pairs for branch pages listed in a sitemap"""
+    entries = []
+    root = ET.fromstring(xml_text)
+    for url_elem in root.iter():
+        if not url_elem.tag.endswith('url'):
+            continue
+        loc = None
+        lastmod = None
+        for child in url_elem:
+            if child.tag.endswith('loc'):
+                loc = (child.text or '').strip()
+            elif child.tag.endswith('lastmod'):
+                lastmod = (child.text or '').strip() or None
+        # Filter only branch URLs (containing 'subesi')
+        if loc and 'subesi' in loc.lower():
+            entries.append((loc, lastmod))
+    return entries
+
+
+def branch_update(branch: dict, version: int = None) -> dict:
+    """Update document for a scraped branch; its id is only assigned on insert"""
+    fields = {**branch, "search": search_keys(branch), **location_fields(branch), **phone_fields(branch)}
+    if version is not None:
+        fields["updated_version"] = version
+    return {
+        "$set": fields,
+        "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": datetime.utcnow()},
+    }
+
+
+def branch_upsert(branch: dict, version: int = None) -> UpdateOne:
+    """Bulk upsert keyed on source_url"""
+    return UpdateOne({"source_url": branch["source_url"]}, branch_update(branch, version), upsert=True)
+
+
+async def keep_sheet_fields(db, branches: list) -> list:
+    """Branches with the sheet's values for fields an import owns
+
+    dedup.py hands an imported branch the source_url of a scraped duplicate;
+    the page then updates that branch, but the sheet stays authoritative for
+    the fields its import key is built from.
+    """
+    imported = {}
+    cursor = db.branches.find(
+        {"source_url": {"$in": [branch["source_url"] for branch in branches]}, "import_key": {"$exists": True}},
+        {field: 1 for field in SHEET_FIELDS + ("source_url",)}
+    )
+    async for doc in cursor:
+        imported[doc["source_url"]] = {field: doc[field] for field in SHEET_FIELDS if field in doc}
+    if not imported:
+        return branches
+    return [{**branch, **imported.get(branch["source_url"], {})} for branch in branches]
+
+
+def make_client(concurrency: int, timeout: float = 30.0) -> httpx.AsyncClient:
+    """One pooled keep-alive client shared by all crawl workers"""
+    return httpx.AsyncClient(
+        timeout=timeout,
+        follow_redirects=True,
+        headers={'User-Agent': USER_AGENT},
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+    )
+
+
+class HostThrottle:
+    """Caps concurrent requests and request rate for a single host"""
+
+    def __init__(self, concurrency: int, rate: float):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        if self._interval:
+            async with self._lock:
+                now = time.monotonic()
+                wait = self._next_slot - now
+                self._next_slot = max(now, self._next_slot) + self._interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._semaphore.release()
+
+
+@dataclass
+class CrawlStats:
+    sitemaps: int = 0
+    urls: int = 0
+    pages: int = 0
+    skipped: int = 0
+    not_modified: int = 0
+    unchanged: int = 0
+    parsed: int = 0
+    failed: int = 0
+    upserted: int = 0
+    modified: int = 0
+    retries: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: float = None
+    errors: list = field(default_factory=list)
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "sitemaps": self.sitemaps,
+            "urls": self.urls,
+            "pages": self.pages,
+            "skipped": self.skipped,
+            "not_modified": self.not_modified,
+            "unchanged": self.unchanged,
+            "parsed": self.parsed,
+            "failed": self.failed,
+            "upserted": self.upserted,
+            "modified": self.modified,
+            "retries": self.retries,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "pages_per_second": round(self.pages_per_second, 2),
+            "errors": self.errors[-20:],
+        }
+
+
+class BranchCrawler:
+    """Sitemap -> worker pool -> batched bulk_write pipeline"""
+
+    def __init__(self, db, base_url: str = CRAWL_BASE_URL, concurrency: int = 16,
+                 per_host_concurrency: int = 8, rate: float = 20.0, retries: int = 3,
+                 backoff: float = 0.5, batch_size: int = 200, extractor: ExtractorPool = None,
+                 incremental: bool = True, store: PageStore = None):
+        self.db = db
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.extractor = extractor
+        self.incremental = incremental
+        self.store = store
+        self.stats = CrawlStats()
+        self._throttles = {}
+        self._batch = []
+        self._state = {}        # url -> crawl_state document from the previous crawl
+        self._state_batch = []
+
+    def _throttle(self, url: str) -> HostThrottle:
+        host = urlsplit(url).netloc
+        throttle = self._throttles.get(host)
+        if throttle is None:
+            throttle = self._throttles[host] = HostThrottle(self.per_host_concurrency, self.rate)
+        return throttle
+
+    async def fetch(self, client: httpx.AsyncClient, url: str, headers: dict = None) -> httpx.Response:
+        """GET with per-host throttling and exponential backoff on transient errors"""
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._throttle(url):
+                    response = await client.get(url, headers=headers)
+                if response.status_code == 304:
+                    return response
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                retry_after = response.headers.get('retry-after', '')
+                delay = float(retry_after) if retry_after.isdigit() else None
+                error = httpx.HTTPStatusError(
+                    f"{response.status_code} for {url}", request=response.request, response=response)
+            except httpx.TransportError as e:
+                delay = None
+                error = e
+            if attempt == self.retries:
+                raise error
+            self.stats.retries += 1
+            await asyncio.sleep(delay if delay is not None else self.backoff * (2 ** attempt) * (1 + random.random()))
+
+    async def iter_sitemap_entries(self, client: httpx.AsyncClient, sitemap_indexes):
+        """Fetch all sitemaps concurrently, yielding entries as each one arrives"""
+        tasks = [asyncio.create_task(self.fetch(client, sitemap_url(self.base_url, i))) for i in sitemap_indexes]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    response = await next_done
+                except Exception as e:
+                    self.stats.errors.append(f"sitemap: {e}")
+                    continue
+                self.stats.sitemaps += 1
+                for entry in parse_sitemap(response.text):
+                    yield entry
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    async def _listed_entries(urls):
+        for url in urls:
+            yield url, None
+
+    async def load_state(self):
+        """Load crawl state for all known URLs in one pass"""
+        self._state = {}
+        async for doc in self.db.crawl_state.find({}):
+            self._state[doc['_id']] = doc
+
+    def _record_state(self, url: str, lastmod: str, response: httpx.Response, content_hash: str, previous: dict):
+        # A 304 need not repeat the validators, so keep the ones we had
+        previous = previous or {}
+        state = {
+            "lastmod": lastmod,
+            "etag": response.headers.get('etag') or previous.get('etag'),
+            "last_modified": response.headers.get('last-modified') or previous.get('last_modified'),
+            "content_hash": content_hash,
+            "fetched_at": datetime.utcnow(),
+        }
+        self._state_batch.append(UpdateOne({"_id": url}, {"$set": state}, upsert=True))
+
+    async def flush(self):
+        batch, self._batch = self._batch, []
+        state_batch, self._state_batch = self._state_batch, []
+        if batch:
+            async with write_version(self.db) as version:
+                batch = await keep_sheet_fields(self.db, batch)
+                result = await self.db.branches.bulk_write(
+                    [branch_upsert(branch, version) for branch in batch], ordered=False)
+            self.stats.upserted += result.upserted_count
+            self.stats.modified += result.modified_count
+        # Branches go first so a crash never records state for an unsaved page
+        if state_batch:
+            await self.db.crawl_state.bulk_write(state_batch, ordered=False)
+
+    async def process(self, client: httpx.AsyncClient, url: str, lastmod: str = None):
+        """Fetch one branch page and queue its upsert if the content changed"""
+        previous = self._state.get(url) if self.incremental else None
+        if previous and lastmod and previous.get('lastmod') == lastmod and previous.get('content_hash'):
+            self.stats.skipped += 1
+            return
+
+        headers = {}
+        if previous:
+            if previous.get('etag'):
+                headers['If-None-Match'] = previous['etag']
+            if previous.get('last_modified'):
+                headers['If-Modified-Since'] = previous['last_modified']
+
+        response = await self.fetch(client, url, headers=headers)
+        self.stats.pages += 1
+
+        if response.status_code == 304:
+            self.stats.not_modified += 1
+            content_hash = previous.get('content_hash')
+        else:
+            content_hash = hashlib.sha256(response.content).hexdigest()
+            if self.store is not None:
+                await asyncio.to_thread(self.store.put, content_hash, response.content, response.encoding)
+            if previous and previous.get('content_hash') == content_hash:
+                self.stats.unchanged += 1
+            else:
+                branch = await self.extractor.extract(response.text, url)
+                self.stats.parsed += 1
+                self._batch.append(branch)
+
+        self._record_state(url, lastmod, response, content_hash, previous)
+        if len(self._batch) + len(self._state_batch) >= self.batch_size:
+            await self.flush()
+
+    async def reparse_one(self, url: str, content_hash: str):
+        """Extract one page from the page store and queue its upsert"""
+        path = await asyncio.to_thread(self.store.path, content_hash)
+        if path is None:
+            raise LookupError(f"content {content_hash} is not in the page store")
+        self.stats.pages += 1
+        branch = await self.extractor.extract_stored(str(path), url)
+        self.stats.parsed += 1
+        self._batch.append(branch)
+        if len(self._batch) >= self.batch_size:
+            await self.flush()
+
+    async def _worker(self, handle, queue: asyncio.Queue):
+        while True:
+            entry = await queue.get()
+            try:
+                if entry is None:
+                    return
+                try:
+                    await handle(*entry)
+                except Exception as e:
+                    self.stats.failed += 1
+                    self.stats.errors.append(f"{entry[0]}: {e}")
+            finally:
+                queue.task_done()
+
+    @contextlib.asynccontextmanager
+    async def _workers(self, handle):
+        """Queue feeding a pool of workers that call handle(*entry)"""
+        queue = asyncio.Queue(maxsize=self.concurrency * 4)
+        own_extractor = self.extractor is None
+        if own_extractor:
+            self.extractor = ExtractorPool()
+        workers = [asyncio.create_task(self._worker(handle, queue)) for _ in range(self.concurrency)]
+        try:
+            yield queue
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            if own_extractor:
+                self.extractor.shutdown()
+                self.extractor = None
+        await self.flush()
+
+    async def run(self, sitemap_indexes=None, max_urls: int = None, urls: list = None) -> CrawlStats:
+        """Crawl every branch URL in the given sitemaps (all seven by default)
+
+        Pass ``urls`` to crawl just those pages instead of the sitemaps.
+        """
+        sitemap_indexes = sitemap_indexes or range(1, SITEMAP_COUNT + 1)
+        self.stats = CrawlStats()
+        seen = set()
+        if self.incremental:
+            await self.load_state()
+
+        async with make_client(self.concurrency) as client:
+            async with self._workers(functools.partial(self.process, client)) as queue:
+                if urls:
+                    entries = self._listed_entries(urls)
+                else:
+                    entries = self.iter_sitemap_entries(client, sitemap_indexes)
+                async with contextlib.aclosing(entries):
+                    async for url, lastmod in entries:
+                        if url in seen:
+                            continue
+                        if max_urls is not None and len(seen) >= max_urls:
+                            break
+                        seen.add(url)
+                        self.stats.urls += 1
+                        await queue.put((url, lastmod))
+
+        self.stats.finished_at = time.monotonic()
+        return self.stats
+
+    async def reparse(self, urls: list = None, max_urls: int = None) -> CrawlStats:
+        """Re-run extraction over the stored page of every crawled URL (or just ``urls``)
+
+        Nothing is fetched: crawl_state gives each URL's latest content hash
+        and the page store holds the page. Pages are read, decompressed and
+        parsed in the extractor's worker pool and upserted in batches.
+        """
+        if self.store is None:
+            raise ValueError("reparse needs a page store")
+        self.stats = CrawlStats()
+        query = {"content_hash": {"$ne": None}}
+        if urls:
+            query["_id"] = {"$in": list(urls)}
+        cursor = self.db.crawl_state.find(query, {"content_hash": 1})
+        if max_urls is not None:
+            cursor = cursor.limit(max_urls)
+
+        async with self._workers(self.reparse_one) as queue:
+            async for doc in cursor:
+                self.stats.urls += 1
+                await queue.put((doc["_id"], doc["content_hash"]))
+
+        self.stats.finished_at = time.monotonic()
+        return self.stats
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Crawl kargolojik.com branch pages into MongoDB")
+    parser.add_argument('--base-url', default=CRAWL_BASE_URL)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--per-host', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=20.0, help="max requests per second per host (0 = unlimited)")
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--max-urls', type=int, default=None)
+    parser.add_argument('--full', action='store_true', help="ignore crawl state and re-fetch every page")
+    parser.add_argument('--extractor', choices=sorted(EXTRACTORS), default=None)
+    parser.add_argument('--store', default=None, help="page store directory (default $PAGE_STORE_DIR)")
+    parser.add_argument('--reparse', action='store_true',
+                        help="re-extract the stored pages of all crawled URLs instead of crawling")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+    crawler = BranchCrawler(db, base_url=args.base_url, concurrency=args.concurrency,
+                            per_host_concurrency=args.per_host, rate=args.rate, batch_size=args.batch_size,
+                            extractor=ExtractorPool(engine=args.extractor), incremental=not args.full,
+                            store=PageStore(args.store or PAGE_STORE_DIR))
+    try:
+        if args.reparse:
+            stats = await crawler.reparse(max_urls=args.max_urls)
+        else:
+            stats = await crawler.run(max_urls=args.max_urls)
+    finally:
+        crawler.extractor.shutdown()
+
+    for key, value in stats.to_dict().items():
+        if key != 'errors':
+            print(f"{key}: {value}")
+    for error in stats.errors:
+        print(f"error: {error}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+"""
+Data version counter for the branches collection.
+
+Every code path that writes branches (import_branches.py, the crawler, the
+scrape, bulk and seed endpoints, dedup.py) takes a fresh version for each
+write batch with ``write_version``. The published data version only moves
+once every batch holding a version at or below it has finished, so
+in-process structures built from the collection, such as the search index,
+know when they have gone stale and never see half of a batch.
+
+The same counter drives delta sync: writers stamp each branch they write
+with ``updated_version`` (their batch's version) and leave a tombstone in
+``branch_tombstones`` for each branch they delete. Versions are only handed
+out above the published version, so /api/branches/changes?since=V returns
+every write that completed after V was read, however many writers overlap.
+
+The version document keeps the last version handed out in ``version`` and
+the batches still writing in ``writing``. A batch whose process died is
+ignored once its lease runs out.
+"""
+
+import contextlib
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+
+VERSION_DOC_ID = 'branches_version'
+TOMBSTONE_BATCH_SIZE = 1000
+WRITE_LEASE_SECONDS = 600   # far longer than any single batch takes
+
+
+def published_version(doc) -> int:
+    """Highest version whose writers have all finished"""
+    if not doc:
+        return 0
+    now = datetime.utcnow()
+    live = [w['version'] for w in doc.get('writing', []) if w['until'] > now]
+    return min(live) - 1 if live else doc['version']
+
+
+async def get_data_version(db) -> int:
+    """Return the published branches data version (0 if never written)"""
+    return published_version(await db.meta.find_one({'_id': VERSION_DOC_ID}))
+
+
+async def start_write(db) -> int:
+    """Reserve the next version for a write batch; it stays unpublished until finish_write"""
+    await db.meta.update_one({'_id': VERSION_DOC_ID}, {'$setOnInsert': {'version': 0}}, upsert=True)
+    while True:
+        doc = await db.meta.find_one({'_id': VERSION_DOC_ID}, {'version': 1})
+        version = doc['version'] + 1
+        until = datetime.utcnow() + timedelta(seconds=WRITE_LEASE_SECONDS)
+        # Compare-and-set, so the version is handed out and marked as
+        # writing in the same update
+        taken = await db.meta.find_one_and_update(
+            {'_id': VERSION_DOC_ID, 'version': doc['version']},
+            {'$set': {'version': version}, '$push': {'writing': {'version': version, 'until': until}}},
+            return_document=ReturnDocument.AFTER
+        )
+        if taken is not None:
+            return version
+
+
+async def finish_write(db, version: int):
+    """Publish a write batch's version once no earlier batch is still writing"""
+    await db.meta.update_one({'_id': VERSION_DOC_ID}, {'$pull': {'writing': {'version': version}}})
+    # Drop batches of writers that died
+    await db.meta.update_one({'_id': VERSION_DOC_ID},
+                             {'$pull': {'writing': {'until': {'$lt': datetime.utcnow()}}}})
+
+
+@contextlib.asynccontextmanager
+async def write_version(db):
+    """Version to stamp on the branches of one write batch"""
+    version = await start_write(db)
+    try:
+        yield version
+    finally:
+        await finish_write(db, version)
+
+
+async def delete_branches(db, query: dict) -> int:
+    """Delete matching branches, leaving a tombstone for each"""
+    ids = [doc['_id'] async for doc in db.branches.find(query, {'_id': 1})]
+    deleted = 0
+    for i in range(0, len(ids), TOMBSTONE_BATCH_SIZE):
+        chunk = ids[i:i + TOMBSTONE_BATCH_SIZE]
+        async with write_version(db) as version:
+            now = datetime.utcnow()
+            await db.branch_tombstones.bulk_write([
+                UpdateOne({'_id': str(doc_id)}, {'$set': {'deleted_version': version, 'deleted_at': now}}, upsert=True)
+                for doc_id in chunk
+            ], ordered=False)
+            result = await db.branches.delete_many({'_id': {'$in': chunk}})
+        deleted += result.deleted_count
+    return deleted
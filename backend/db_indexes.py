@@ -0,0 +1,93 @@
+"""
+MongoDB index definitions for the branches collection.
+
+Created on API startup (and by import_branches.py) so that searches on the
+normalized ``search`` keys are index-backed. create_indexes is idempotent,
+so running it on every start is cheap.
+"""
+
+from pymongo import ASCENDING, GEOSPHERE, IndexModel, UpdateOne
+
+from data_version import write_version
+from geo import location_fields
+from phones import phone_fields
+from search_keys import search_keys
+
+BRANCH_INDEXES = [
+    # Anchored prefix lookups for each search word
+    IndexModel([('search.tokens', ASCENDING)], name='search_tokens'),
+    # Company/city filter chips, alone or combined
+    IndexModel([('search.company', ASCENDING), ('search.city', ASCENDING), ('search.name', ASCENDING)],
+               name='search_company_city_name'),
+    IndexModel([('search.city', ASCENDING), ('search.district', ASCENDING)], name='search_city_district'),
+    # Prefix search and stable ordering by name
+    IndexModel([('search.name', ASCENDING), ('_id', ASCENDING)], name='search_name_id'),
+    # Natural keys used by the upserting write paths
+    IndexModel([('id', ASCENDING)], name='id'),
+    IndexModel([('source_url', ASCENDING)], name='source_url'),
+    IndexModel([('company', ASCENDING), ('import_key', ASCENDING)], name='company_import_key'),
+    # A company's imported rows by import key prefix
+    IndexModel([('import_key', ASCENDING)], name='import_key', sparse=True),
+    # $nearSphere lookups; documents without a location are not indexed
+    IndexModel([('location', GEOSPHERE)], name='location_2dsphere'),
+    # Delta sync: rows written since a data version
+    IndexModel([('updated_version', ASCENDING)], name='updated_version'),
+    # Reverse lookup by E.164 number; multikey over all numbers of a branch
+    IndexModel([('phones', ASCENDING)], name='phones'),
+    # Ids and import keys of branches merged away by dedup.py
+    IndexModel([('merged_ids', ASCENDING)], name='merged_ids', sparse=True),
+    IndexModel([('merged_import_keys', ASCENDING)], name='merged_import_keys', sparse=True),
+]
+
+TOMBSTONE_INDEXES = [
+    IndexModel([('deleted_version', ASCENDING)], name='deleted_version'),
+]
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+async def ensure_indexes(db):
+    """Create the branch indexes if they do not exist yet"""
+    await db.branch_tombstones.create_indexes(TOMBSTONE_INDEXES)
+    return await db.branches.create_indexes(BRANCH_INDEXES)
+
+
+async def _write_backfill(db, batch: list):
+    """Write (branch _id, fields) pairs as one versioned batch, so delta sync sends them"""
+    async with write_version(db) as version:
+        await db.branches.bulk_write([
+            UpdateOne({'_id': doc_id}, {'$set': {**fields, 'updated_version': version}})
+            for doc_id, fields in batch
+        ], ordered=False)
+
+
+async def _backfill(db, field: str, make_update) -> int:
+    """Set ``make_update(doc)`` on every branch that lacks ``field``"""
+    updated = 0
+    batch = []
+    cursor = db.branches.find({field: {'$exists': False}})
+    async for doc in cursor:
+        batch.append((doc['_id'], make_update(doc)))
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            await _write_backfill(db, batch)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await _write_backfill(db, batch)
+        updated += len(batch)
+    return updated
+
+
+async def backfill_search_keys(db) -> int:
+    """Add search keys to branches written before they existed"""
+    return await _backfill(db, 'search', lambda doc: {'search': search_keys(doc)})
+
+
+async def backfill_locations(db) -> int:
+    """Add coordinates to branches written before they existed"""
+    return await _backfill(db, 'location', location_fields)
+
+
+async def backfill_phones(db) -> int:
+    """Add normalized phone numbers to branches written before they existed"""
+    return await _backfill(db, 'phones', phone_fields)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Find and merge branches stored more than once.
+
+The Excel import, the crawler and the seeder key branches differently
+(import key, source_url, name), so the same physical branch can end up in
+the collection two or three times. This job compares branches on folded
+name, address and phone and merges each group of duplicates into one
+canonical document.
+
+Only records that share a block are compared: same carrier and same
+city/district, or same carrier and same phone number. Blocks larger than
+BLOCK_LIMIT are compared within a sliding window over their names, so the
+work stays close to linear in the number of branches. Phone numbers shared
+by many branches (call centres) are ignored.
+
+The canonical document is the imported row if there is one, else the
+scraped page, else the oldest; empty fields are filled from its duplicates,
+it takes over a duplicate's source_url so later crawls update it (an
+imported canonical keeps its sheet's name, company, city and district), and
+the ids it absorbed are kept in ``merged_ids``, which the API resolves, so
+old ids keep working. Import keys of merged rows go to
+``merged_import_keys``; diff imports treat those sheet rows as present and
+do not re-create them. Duplicates are deleted with tombstones only after
+their canonical is written. Nothing is written without --apply:
+
+    python dedup.py [--apply] [--min-score 0.75] [--report dedup.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+from pymongo import UpdateMany, UpdateOne
+
+from data_version import delete_branches, write_version
+from geo import location_fields
+from phones import phone_fields, phone_numbers
+from search_keys import normalize_text, search_keys, tokenize
+
+MIN_SCORE = 0.75
+BLOCK_LIMIT = 100           # larger blocks are compared within a window
+WINDOW = 20
+SHARED_PHONE_LIMIT = 5      # a number on more branches than this is not evidence
+WEIGHTS = {'name': 0.45, 'address': 0.35, 'phone': 0.2}
+
+COMPANY_NOISE = {'kargo', 'express', 'ekspres', 'lojistik', 'tasimacilik'}
+NAME_NOISE = {'sube', 'subesi', 'kargo', 'acente', 'acentesi', 'acentasi', 'magaza', 'magazasi',
+              'express', 'ekspres'}
+ADDRESS_ABBREVIATIONS = {
+    'mahallesi': 'mah', 'mahalle': 'mah', 'mh': 'mah',
+    'caddesi': 'cad', 'cadde': 'cad', 'cd': 'cad',
+    'sokak': 'sok', 'sokagi': 'sok', 'sk': 'sok',
+    'bulvari': 'bulv', 'blv': 'bulv', 'bul': 'bulv',
+    'numara': 'no', 'nolu': 'no',
+}
+ADDRESS_NOISE = {'no', 'kat', 'daire', 'turkiye'}
+MERGE_FIELDS = ('district', 'address', 'phone', 'working_hours', 'google_maps_url', 'logo_url', 'source_url')
+PROJECTION = {'search': 0}
+
+
+def company_key(company) -> str:
+    """Carrier name without generic words: 'Aras Kargo' and 'Aras' match"""
+    return ' '.join(t for t in tokenize(company) if t not in COMPANY_NOISE)
+
+
+def phone_key(doc: dict) -> str:
+    """First E.164 number of a branch, or ''"""
+    numbers = doc.get('phones')
+    if numbers is None:
+        numbers = phone_numbers(doc.get('phone'))
+    return numbers[0] if numbers else ''
+
+
+def name_tokens(name, company) -> frozenset:
+    noise = NAME_NOISE | set(company_key(company).split())
+    return frozenset(t for t in tokenize(name) if t not in noise)
+
+
+def address_tokens(address) -> frozenset:
+    tokens = (ADDRESS_ABBREVIATIONS.get(t, t) for t in tokenize(address))
+    return frozenset(t for t in tokens if t not in ADDRESS_NOISE)
+
+
+def jaccard(a: frozenset, b: frozenset):
+    if not a or not b:
+        return None
+    return len(a & b) / len(a | b)
+
+
+@dataclass
+class Profile:
+    """Normalized view of one branch used for blocking and scoring"""
+    company: str
+    city: str
+    district: str
+    name: frozenset
+    address: frozenset
+    phone: str
+    sort_name: str
+
+
+def profile(doc: dict) -> Profile:
+    return Profile(
+        company=company_key(doc.get('company')),
+        city=normalize_text(doc.get('city')),
+        district=normalize_text(doc.get('district')),
+        name=name_tokens(doc.get('name'), doc.get('company')),
+        address=address_tokens(doc.get('address')),
+        phone=phone_key(doc),
+        sort_name=' '.join(sorted(name_tokens(doc.get('name'), doc.get('company')))),
+    )
+
+
+def similarity(a: Profile, b: Profile):
+    """Weighted name/address/phone similarity in [0, 1], or None if names can't be compared"""
+    name = jaccard(a.name, b.name)
+    if name is None:
+        return None
+    parts = {'name': name, 'address': jaccard(a.address, b.address)}
+    if a.phone and b.phone:
+        parts['phone'] = 1.0 if a.phone == b.phone else 0.0
+    known = {k: v for k, v in parts.items() if v is not None}
+    total = sum(WEIGHTS[k] for k in known)
+    return sum(WEIGHTS[k] * v for k, v in known.items()) / total
+
+
+def candidate_pairs(profiles: list) -> set:
+    """(i, j) index pairs that share a block"""
+    phone_counts = defaultdict(int)
+    for p in profiles:
+        if p.phone:
+            phone_counts[p.phone] += 1
+
+    blocks = defaultdict(list)
+    for i, p in enumerate(profiles):
+        if not p.company or not p.name:
+            continue
+        blocks[('place', p.company, p.city, p.district)].append(i)
+        if p.phone and phone_counts[p.phone] <= SHARED_PHONE_LIMIT:
+            blocks[('phone', p.company, p.phone)].append(i)
+
+    pairs = set()
+    for members in blocks.values():
+        if len(members) < 2:
+            continue
+        if len(members) <= BLOCK_LIMIT:
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    pairs.add((members[x], members[y]))
+        else:
+            members.sort(key=lambda i: profiles[i].sort_name)
+            for x in range(len(members)):
+                for y in range(x + 1, min(x + WINDOW, len(members))):
+                    pairs.add((min(members[x], members[y]), max(members[x], members[y])))
+    return pairs
+
+
+def find_clusters(docs: list, min_score: float = MIN_SCORE) -> tuple:
+    """Groups of duplicate documents, with the best score linking each member
+
+    Returns (clusters, number of pairs compared); each cluster is a list of
+    (doc index, score) with at least two members.
+    """
+    profiles = [profile(doc) for doc in docs]
+    pairs = candidate_pairs(profiles)
+
+    parent = list(range(len(docs)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    best = {}
+    for i, j in pairs:
+        score = similarity(profiles[i], profiles[j])
+        if score is None or score < min_score:
+            continue
+        parent[find(i)] = find(j)
+        best[i] = max(best.get(i, 0.0), score)
+        best[j] = max(best.get(j, 0.0), score)
+
+    groups = defaultdict(list)
+    for i in best:
+        groups[find(i)].append((i, round(best[i], 3)))
+    return [members for members in groups.values() if len(members) > 1], len(pairs)
+
+
+def source_rank(doc: dict) -> tuple:
+    """Sort key putting the best canonical candidate first"""
+    if doc.get('import_key'):
+        source = 0
+    elif doc.get('source_url'):
+        source = 1
+    else:
+        source = 2
+    filled = sum(1 for field in MERGE_FIELDS if doc.get(field))
+    return source, -filled, doc.get('created_at') or datetime.max
+
+
+def merge_cluster(docs: list) -> tuple:
+    """(canonical doc, $set fields for it, duplicate docs)"""
+    ordered = sorted(docs, key=source_rank)
+    canonical, duplicates = ordered[0], ordered[1:]
+    merged = dict(canonical)
+    for field in MERGE_FIELDS:
+        if merged.get(field):
+            continue
+        for dup in duplicates:
+            if dup.get(field):
+                merged[field] = dup[field]
+                break
+    fields = {field: merged[field] for field in MERGE_FIELDS if merged.get(field) != canonical.get(field)}
+    fields['search'] = search_keys(merged)
+    fields.update(location_fields(merged))
+    fields.update(phone_fields(merged))
+    return canonical, fields, duplicates
+
+
+def describe(doc: dict) -> dict:
+    return {
+        'id': str(doc['_id']),
+        'name': doc.get('name', ''),
+        'company': doc.get('company', ''),
+        'city': doc.get('city', ''),
+        'district': doc.get('district', ''),
+        'source': 'import' if doc.get('import_key') else 'crawl' if doc.get('source_url') else 'other',
+    }
+
+
+async def dedup_branches(db, apply: bool = False, min_score: float = MIN_SCORE) -> dict:
+    """Find duplicate branches and, with apply, merge them; returns a report"""
+    docs = await db.branches.find({}, PROJECTION).to_list(length=None)
+    clusters, compared = find_clusters(docs, min_score)
+    report = {'branches': len(docs), 'pairs_compared': compared, 'clusters': len(clusters),
+              'merged': 0, 'applied': apply, 'groups': []}
+
+    updates = []
+    duplicate_ids = []
+    for members in clusters:
+        scores = {id(docs[i]): score for i, score in members}
+        canonical, fields, duplicates = merge_cluster([docs[i] for i, _ in members])
+        report['groups'].append({
+            'canonical': describe(canonical),
+            'duplicates': [{**describe(dup), 'score': scores[id(dup)]} for dup in duplicates],
+            'filled': sorted(f for f in fields if f in MERGE_FIELDS),
+        })
+        report['merged'] += len(duplicates)
+        if apply:
+            merged_ids = []
+            merged_import_keys = []
+            for dup in duplicates:
+                merged_ids += [str(dup['_id'])] + ([dup['id']] if dup.get('id') else []) + dup.get('merged_ids', [])
+                merged_import_keys += ([dup['import_key']] if dup.get('import_key') else []) + \
+                    dup.get('merged_import_keys', [])
+            added = {'merged_ids': {'$each': merged_ids}}
+            if merged_import_keys:
+                added['merged_import_keys'] = {'$each': merged_import_keys}
+            updates.append((canonical['_id'], fields, added, [dup['_id'] for dup in duplicates]))
+            duplicate_ids.extend(dup['_id'] for dup in duplicates)
+
+    if apply and updates:
+        # The canonicals record the merged ids before any duplicate is
+        # deleted, so a run that stops half way loses no ids
+        for i in range(0, len(updates), 1000):
+            async with write_version(db) as version:
+                ops = []
+                for doc_id, fields, added, dup_ids in updates[i:i + 1000]:
+                    # Clear the duplicates' source_url first so a crawl never sees two rows with it
+                    ops.append(UpdateMany({'_id': {'$in': dup_ids}},
+                                          {'$set': {'source_url': '', 'updated_version': version}}))
+                    ops.append(UpdateOne({'_id': doc_id},
+                                         {'$set': {**fields, 'updated_version': version}, '$addToSet': added}))
+                await db.branches.bulk_write(ops, ordered=True)
+        for i in range(0, len(duplicate_ids), 1000):
+            await delete_branches(db, {'_id': {'$in': duplicate_ids[i:i + 1000]}})
+    return report
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Find and merge duplicate branches")
+    parser.add_argument('--apply', action='store_true', help="merge the duplicates (default: report only)")
+    parser.add_argument('--min-score', type=float, default=MIN_SCORE)
+    parser.add_argument('--report', default=None, help="write the full report as JSON to this file")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+    report = await dedup_branches(db, apply=args.apply, min_score=args.min_score)
+    print(f"Compared {report['pairs_compared']} pairs among {report['branches']} branches")
+    print(f"Found {report['clusters']} duplicate groups, {report['merged']} branches "
+          f"{'merged' if args.apply else 'would be merged'}")
+    for group in report['groups'][:20]:
+        canonical = group['canonical']
+        print(f"  {canonical['name']} ({canonical['city']}/{canonical['district']}, {canonical['source']})")
+        for dup in group['duplicates']:
+            print(f"    <- {dup['name']} ({dup['source']}, score {dup['score']})")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Report written to {args.report}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,197 @@
+"""
+Branch detail extraction for kargolojik.com pages.
+
+Shared by the single-URL scrape endpoint and the sitemap crawler so both
+produce identical branch documents from the same HTML. Two interchangeable
+engines are available:
+
+- ``lxml`` (default): libxml2 HTML parser and XPath lookups.
+- ``bs4``: the original BeautifulSoup ``html.parser`` implementation.
+
+Both share the same precompiled patterns and return the same fields.
+Parsing is CPU-bound, so callers on the event loop go through
+ExtractorPool, which runs the engine in a process (or thread) pool.
+benchmarks/bench_extraction.py compares the engines on a saved page.
+"""
+
+import asyncio
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import lxml.html
+from lxml import etree
+from bs4 import BeautifulSoup
+
+from page_store import read_page
+
+COMPANY_KEYWORDS = ['PTT', 'Yurtiçi', 'Aras', 'MNG', 'Sürat', 'UPS', 'DHL', 'FedEx', 'TNT', 'Inter Global']
+
+LOCATION_PATTERN = re.compile(r'📍.*?Konum:?\s*([^/]+)/\s*(.+)')
+ADDRESS_PATTERN = re.compile(r'🏠.*?Adres:?\s*(.+?)(?=📞|<)', re.DOTALL)
+PHONE_PATTERN = re.compile(r'📞.*?Telefon:?\s*([0-9\s\-/]+)')
+TAG_PATTERN = re.compile(r'<[^>]+>')
+
+MAPS_LINK_XPATH = "//a[contains(@href, 'google.com/maps')]/@href"
+LOGO_IMG_XPATH = "//img[contains(translate(@src, 'LOGO', 'logo'), 'logo')]/@src"
+
+
+def _search_from(pattern: re.Pattern, html: str, marker: str):
+    """Run pattern starting at the first marker emoji instead of offset 0"""
+    pos = html.find(marker)
+    if pos < 0:
+        return None
+    return pattern.search(html, pos)
+
+
+def _company_from_name(name: str) -> str:
+    name_lower = name.lower()
+    for kw in COMPANY_KEYWORDS:
+        if kw.lower() in name_lower:
+            return kw
+    return ""
+
+
+def _text_fields(html: str) -> dict:
+    """Fields pulled from the raw page text with the emoji-marker patterns"""
+    city = ""
+    district = ""
+    location_match = _search_from(LOCATION_PATTERN, html, '📍')
+    if location_match:
+        city = location_match.group(1).strip()
+        district = location_match.group(2).strip()
+
+    address = ""
+    address_match = _search_from(ADDRESS_PATTERN, html, '🏠')
+    if address_match:
+        address = TAG_PATTERN.sub('', address_match.group(1).strip()).strip()
+
+    phone = ""
+    phone_match = _search_from(PHONE_PATTERN, html, '📞')
+    if phone_match:
+        phone = phone_match.group(1).strip()
+
+    return {"city": city, "district": district, "address": address, "phone": phone}
+
+
+def _branch(name: str, text_fields: dict, google_maps_url: str, logo_url: str, url: str) -> dict:
+    return {
+        "name": name,
+        "company": _company_from_name(name),
+        "city": text_fields["city"],
+        "district": text_fields["district"],
+        "address": text_fields["address"],
+        "phone": text_fields["phone"],
+        "google_maps_url": google_maps_url,
+        "logo_url": logo_url,
+        "source_url": url
+    }
+
+
+def extract_branch_bs4(html: str, url: str) -> dict:
+    """Extract branch fields with BeautifulSoup's html.parser"""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    name = ""
+    h1 = soup.find('h1')
+    if h1:
+        name = h1.get_text(strip=True)
+
+    google_maps_url = ""
+    maps_link = soup.find('a', href=lambda h: h and 'google.com/maps' in h)
+    if maps_link:
+        google_maps_url = maps_link['href']
+
+    logo_url = ""
+    logo_img = soup.find('img', src=lambda s: s and 'logo' in s.lower())
+    if logo_img:
+        logo_url = logo_img['src']
+
+    return _branch(name, _text_fields(html), google_maps_url, logo_url, url)
+
+
+def extract_branch_lxml(html: str, url: str) -> dict:
+    """Extract branch fields with lxml's HTML parser"""
+    try:
+        root = lxml.html.document_fromstring(html)
+    except ValueError:
+        # Unicode input with an XML encoding declaration
+        root = lxml.html.document_fromstring(html.encode('utf-8'))
+    except etree.ParserError:
+        root = None
+
+    name = ""
+    google_maps_url = ""
+    logo_url = ""
+    if root is not None:
+        h1 = root.find('.//h1')
+        if h1 is not None:
+            # Same result as BeautifulSoup's get_text(strip=True)
+            name = ''.join(t.strip() for t in h1.itertext())
+        maps_links = root.xpath(MAPS_LINK_XPATH)
+        if maps_links:
+            google_maps_url = str(maps_links[0])
+        logo_srcs = root.xpath(LOGO_IMG_XPATH)
+        if logo_srcs:
+            logo_url = str(logo_srcs[0])
+
+    return _branch(name, _text_fields(html), google_maps_url, logo_url, url)
+
+
+EXTRACTORS = {
+    'lxml': extract_branch_lxml,
+    'bs4': extract_branch_bs4,
+}
+
+DEFAULT_EXTRACTOR = os.environ.get('BRANCH_EXTRACTOR', 'lxml')
+
+
+def get_extractor(name: str = None):
+    """Look up an extraction engine by name"""
+    name = name or DEFAULT_EXTRACTOR
+    try:
+        return EXTRACTORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown extractor {name!r}, expected one of {sorted(EXTRACTORS)}")
+
+
+def extract_branch(html: str, url: str) -> dict:
+    """Extract branch fields with the configured engine"""
+    return get_extractor()(html, url)
+
+
+def extract_stored_page(extract_fn, path: str, url: str) -> dict:
+    """Read, decompress and extract a page from the page store in one call"""
+    return extract_fn(read_page(path), url)
+
+
+class ExtractorPool:
+    """Runs extraction off the event loop in a process or thread pool"""
+
+    def __init__(self, engine: str = None, workers: int = None, kind: str = None):
+        self.extract_fn = get_extractor(engine)
+        self.workers = workers or int(os.environ.get('EXTRACT_WORKERS', '0')) or min(4, os.cpu_count() or 1)
+        self.kind = kind or os.environ.get('EXTRACT_POOL', 'process')
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def extract(self, html: str, url: str) -> dict:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), self.extract_fn, html, url)
+
+    async def extract_stored(self, path: str, url: str) -> dict:
+        """Like extract, but the worker reads the page from the page store itself"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), extract_stored_page, self.extract_fn, path, url)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,266 @@
+"""
+Branch coordinates and nearest-branch lookups.
+
+Branches have no geocoded position, so every write path stores a GeoJSON
+``location`` derived in this order:
+
+- ``maps_url``: coordinates embedded in google_maps_url (``@lat,lon``,
+  ``!3dlat!4dlon``, ``q=lat,lon`` ...), exact.
+- ``district``: offline centroid of the branch's city + district.
+- ``city``: offline centroid of the province.
+
+``location_source`` records which one was used so clients can tell exact
+pins from approximate ones. The ``location`` field carries a 2dsphere index
+(see db_indexes.py) for MongoDB $nearSphere queries; the API answers from
+GeoGrid, an in-process grid of the same documents.
+"""
+
+import math
+import re
+from collections import defaultdict
+from typing import Optional
+
+from search_keys import normalize_text
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+GRID_CELL_DEGREES = 0.25
+
+_COORD = r'(-?\d{1,2}\.\d+)'
+MAPS_COORDINATE_PATTERNS = [
+    re.compile(r'!3d' + _COORD + r'!4d(-?\d{1,3}\.\d+)'),          # place data, most precise
+    re.compile(r'@' + _COORD + r',(-?\d{1,3}\.\d+)'),               # map viewport
+    re.compile(r'[?&](?:q|query|ll|sll|center|destination)=' + _COORD + r'(?:,|%2C)\s*(-?\d{1,3}\.\d+)', re.I),
+]
+
+# Province centroids (provincial capitals), keyed by folded name
+CITY_CENTROIDS = {
+    'adana': (37.00, 35.32), 'adiyaman': (37.76, 38.28), 'afyonkarahisar': (38.76, 30.54),
+    'agri': (39.72, 43.05), 'aksaray': (38.37, 34.03), 'amasya': (40.65, 35.83),
+    'ankara': (39.93, 32.86), 'antalya': (36.89, 30.71), 'ardahan': (41.11, 42.70),
+    'artvin': (41.18, 41.82), 'aydin': (37.85, 27.85), 'balikesir': (39.65, 27.89),
+    'bartin': (41.63, 32.34), 'batman': (37.88, 41.13), 'bayburt': (40.26, 40.23),
+    'bilecik': (40.14, 29.98), 'bingol': (38.88, 40.50), 'bitlis': (38.40, 42.11),
+    'bolu': (40.73, 31.61), 'burdur': (37.72, 30.29), 'bursa': (40.19, 29.06),
+    'canakkale': (40.15, 26.41), 'cankiri': (40.60, 33.62), 'corum': (40.55, 34.95),
+    'denizli': (37.78, 29.09), 'diyarbakir': (37.91, 40.24), 'duzce': (40.84, 31.16),
+    'edirne': (41.68, 26.56), 'elazig': (38.68, 39.22), 'erzincan': (39.75, 39.49),
+    'erzurum': (39.90, 41.27), 'eskisehir': (39.78, 30.52), 'gaziantep': (37.07, 37.38),
+    'giresun': (40.91, 38.39), 'gumushane': (40.46, 39.48), 'hakkari': (37.58, 43.74),
+    'hatay': (36.20, 36.16), 'igdir': (39.92, 44.05), 'isparta': (37.76, 30.55),
+    'istanbul': (41.01, 28.98), 'izmir': (38.42, 27.14), 'kahramanmaras': (37.58, 36.94),
+    'karabuk': (41.20, 32.62), 'karaman': (37.18, 33.22), 'kars': (40.60, 43.10),
+    'kastamonu': (41.38, 33.78), 'kayseri': (38.72, 35.49), 'kilis': (36.72, 37.12),
+    'kirikkale': (39.85, 33.52), 'kirklareli': (41.73, 27.23), 'kirsehir': (39.15, 34.16),
+    'kocaeli': (40.77, 29.92), 'konya': (37.87, 32.48), 'kutahya': (39.42, 29.98),
+    'malatya': (38.35, 38.31), 'manisa': (38.61, 27.43), 'mardin': (37.31, 40.74),
+    'mersin': (36.81, 34.64), 'mugla': (37.22, 28.36), 'mus': (38.74, 41.49),
+    'nevsehir': (38.62, 34.71), 'nigde': (37.97, 34.68), 'ordu': (40.98, 37.88),
+    'osmaniye': (37.07, 36.25), 'rize': (41.02, 40.52), 'sakarya': (40.78, 30.40),
+    'samsun': (41.29, 36.33), 'sanliurfa': (37.16, 38.79), 'siirt': (37.93, 41.94),
+    'sinop': (42.03, 35.15), 'sirnak': (37.52, 42.46), 'sivas': (39.75, 37.02),
+    'tekirdag': (40.98, 27.51), 'tokat': (40.31, 36.55), 'trabzon': (41.00, 39.72),
+    'tunceli': (39.11, 39.55), 'usak': (38.68, 29.41), 'van': (38.49, 43.38),
+    'yalova': (40.65, 29.27), 'yozgat': (39.82, 34.81), 'zonguldak': (41.45, 31.79),
+}
+
+# Older or informal province names seen in branch data
+CITY_ALIASES = {
+    'icel': 'mersin', 'afyon': 'afyonkarahisar', 'maras': 'kahramanmaras',
+    'k.maras': 'kahramanmaras', 'urfa': 'sanliurfa', 'antakya': 'hatay',
+    'izmit': 'kocaeli', 'adapazari': 'sakarya',
+}
+
+# District centroids for the larger cities, keyed by folded (city, district)
+DISTRICT_CENTROIDS = {
+    ('istanbul', 'adalar'): (40.87, 29.09), ('istanbul', 'arnavutkoy'): (41.18, 28.74),
+    ('istanbul', 'atasehir'): (40.99, 29.12), ('istanbul', 'avcilar'): (40.98, 28.72),
+    ('istanbul', 'bagcilar'): (41.04, 28.86), ('istanbul', 'bahcelievler'): (41.00, 28.86),
+    ('istanbul', 'bakirkoy'): (40.98, 28.87), ('istanbul', 'basaksehir'): (41.09, 28.80),
+    ('istanbul', 'bayrampasa'): (41.05, 28.91), ('istanbul', 'besiktas'): (41.04, 29.01),
+    ('istanbul', 'beykoz'): (41.13, 29.10), ('istanbul', 'beylikduzu'): (40.98, 28.64),
+    ('istanbul', 'beyoglu'): (41.03, 28.98), ('istanbul', 'buyukcekmece'): (41.02, 28.59),
+    ('istanbul', 'catalca'): (41.14, 28.46), ('istanbul', 'cekmekoy'): (41.03, 29.18),
+    ('istanbul', 'esenler'): (41.04, 28.88), ('istanbul', 'esenyurt'): (41.03, 28.68),
+    ('istanbul', 'eyupsultan'): (41.05, 28.93), ('istanbul', 'fatih'): (41.02, 28.94),
+    ('istanbul', 'gaziosmanpasa'): (41.06, 28.91), ('istanbul', 'gungoren'): (41.02, 28.87),
+    ('istanbul', 'kadikoy'): (40.99, 29.03), ('istanbul', 'kagithane'): (41.08, 28.97),
+    ('istanbul', 'kartal'): (40.89, 29.19), ('istanbul', 'kucukcekmece'): (41.00, 28.78),
+    ('istanbul', 'maltepe'): (40.94, 29.13), ('istanbul', 'pendik'): (40.88, 29.26),
+    ('istanbul', 'sancaktepe'): (41.00, 29.23), ('istanbul', 'sariyer'): (41.17, 29.05),
+    ('istanbul', 'silivri'): (41.07, 28.25), ('istanbul', 'sultanbeyli'): (40.96, 29.27),
+    ('istanbul', 'sultangazi'): (41.11, 28.87), ('istanbul', 'sile'): (41.18, 29.61),
+    ('istanbul', 'sisli'): (41.06, 28.99), ('istanbul', 'tuzla'): (40.82, 29.30),
+    ('istanbul', 'umraniye'): (41.02, 29.12), ('istanbul', 'uskudar'): (41.02, 29.02),
+    ('istanbul', 'zeytinburnu'): (40.99, 28.90),
+    ('ankara', 'altindag'): (39.94, 32.88), ('ankara', 'cankaya'): (39.92, 32.85),
+    ('ankara', 'etimesgut'): (39.95, 32.67), ('ankara', 'golbasi'): (39.79, 32.81),
+    ('ankara', 'kecioren'): (39.98, 32.87), ('ankara', 'mamak'): (39.93, 32.92),
+    ('ankara', 'polatli'): (39.58, 32.15), ('ankara', 'pursaklar'): (40.04, 32.90),
+    ('ankara', 'sincan'): (39.97, 32.58), ('ankara', 'yenimahalle'): (39.97, 32.81),
+    ('izmir', 'balcova'): (38.39, 27.05), ('izmir', 'bayrakli'): (38.46, 27.16),
+    ('izmir', 'bornova'): (38.47, 27.22), ('izmir', 'buca'): (38.39, 27.17),
+    ('izmir', 'cigli'): (38.49, 27.07), ('izmir', 'gaziemir'): (38.32, 27.13),
+    ('izmir', 'karabaglar'): (38.37, 27.12), ('izmir', 'karsiyaka'): (38.46, 27.11),
+    ('izmir', 'konak'): (38.42, 27.13), ('izmir', 'menemen'): (38.61, 27.07),
+    ('izmir', 'narlidere'): (38.39, 27.00), ('izmir', 'torbali'): (38.16, 27.36),
+    ('bursa', 'gemlik'): (40.43, 29.16), ('bursa', 'inegol'): (40.08, 29.51),
+    ('bursa', 'mudanya'): (40.38, 28.88), ('bursa', 'nilufer'): (40.21, 28.98),
+    ('bursa', 'osmangazi'): (40.19, 29.06), ('bursa', 'yildirim'): (40.19, 29.10),
+    ('antalya', 'alanya'): (36.54, 32.00), ('antalya', 'kemer'): (36.60, 30.56),
+    ('antalya', 'kepez'): (36.93, 30.70), ('antalya', 'konyaalti'): (36.87, 30.63),
+    ('antalya', 'manavgat'): (36.79, 31.44), ('antalya', 'muratpasa'): (36.89, 30.71),
+    ('adana', 'ceyhan'): (37.03, 35.82), ('adana', 'cukurova'): (37.03, 35.29),
+    ('adana', 'saricam'): (37.04, 35.42), ('adana', 'seyhan'): (36.99, 35.32),
+    ('adana', 'yuregir'): (36.99, 35.37),
+    ('mugla', 'bodrum'): (37.04, 27.43), ('mugla', 'dalaman'): (36.77, 28.80),
+    ('mugla', 'fethiye'): (36.62, 29.12), ('mugla', 'marmaris'): (36.85, 28.27),
+    ('mugla', 'mentese'): (37.22, 28.36), ('mugla', 'milas'): (37.32, 27.78),
+    ('mersin', 'akdeniz'): (36.81, 34.65), ('mersin', 'mezitli'): (36.76, 34.53),
+    ('mersin', 'tarsus'): (36.92, 34.89), ('mersin', 'toroslar'): (36.83, 34.62),
+    ('mersin', 'yenisehir'): (36.80, 34.60),
+    ('kocaeli', 'gebze'): (40.80, 29.43), ('kocaeli', 'izmit'): (40.77, 29.92),
+    ('konya', 'karatay'): (37.87, 32.52), ('konya', 'meram'): (37.84, 32.44),
+    ('konya', 'selcuklu'): (37.90, 32.49),
+    ('kayseri', 'kocasinan'): (38.73, 35.48), ('kayseri', 'melikgazi'): (38.72, 35.50),
+    ('gaziantep', 'sahinbey'): (37.06, 37.38), ('gaziantep', 'sehitkamil'): (37.08, 37.37),
+    ('eskisehir', 'odunpazari'): (39.76, 30.53), ('eskisehir', 'tepebasi'): (39.79, 30.50),
+    ('samsun', 'atakum'): (41.33, 36.27), ('samsun', 'ilkadim'): (41.29, 36.33),
+    ('denizli', 'merkezefendi'): (37.77, 29.07), ('denizli', 'pamukkale'): (37.78, 29.09),
+    ('trabzon', 'akcaabat'): (41.02, 39.57), ('trabzon', 'ortahisar'): (41.00, 39.72),
+}
+
+
+def coordinates_from_maps_url(url: str) -> Optional[tuple]:
+    """(lat, lon) embedded in a Google Maps link, if any"""
+    if not url:
+        return None
+    for pattern in MAPS_COORDINATE_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            lat, lon = float(match.group(1)), float(match.group(2))
+            if -90 <= lat <= 90 and -180 <= lon <= 180 and (lat, lon) != (0.0, 0.0):
+                return lat, lon
+    return None
+
+
+def centroid(city: str, district: str = None) -> Optional[tuple]:
+    """Return (lat, lon, source) from the offline centroid tables"""
+    city = normalize_text(city)
+    city = CITY_ALIASES.get(city, city)
+    point = DISTRICT_CENTROIDS.get((city, normalize_text(district)))
+    if point is not None:
+        return point + ('district',)
+    point = CITY_CENTROIDS.get(city)
+    if point is not None:
+        return point + ('city',)
+    return None
+
+
+def location_fields(branch: dict) -> dict:
+    """``location`` (GeoJSON point or None) and ``location_source`` for a branch"""
+    point = coordinates_from_maps_url(branch.get('google_maps_url'))
+    if point is not None:
+        lat, lon, source = point + ('maps_url',)
+    else:
+        found = centroid(branch.get('city'), branch.get('district'))
+        if found is None:
+            return {'location': None, 'location_source': None}
+        lat, lon, source = found
+    return {
+        'location': {'type': 'Point', 'coordinates': [lon, lat]},
+        'location_source': source,
+    }
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in kilometres"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cell(lat: float, lon: float) -> tuple:
+    return int(math.floor(lat / GRID_CELL_DEGREES)), int(math.floor(lon / GRID_CELL_DEGREES))
+
+
+def _doc_key(doc: dict) -> str:
+    return str(doc.get('_id', doc.get('id')))
+
+
+class GeoGrid:
+    """Fixed lat/lon grid for k-nearest branch lookups
+
+    A query scans rings of cells around the query point and stops once the
+    next ring cannot hold anything closer than the k-th match so far.
+    """
+
+    def __init__(self, docs=()):
+        self._cells = defaultdict(dict)     # cell -> {doc key: (lat, lon, folded company, doc)}
+        self._cell_of = {}                  # doc key -> cell
+        for doc in docs:
+            self.upsert(doc)
+
+    def __len__(self):
+        return len(self._cell_of)
+
+    def upsert(self, doc: dict):
+        """Add or move a document; documents without a location are dropped"""
+        key = _doc_key(doc)
+        self.remove(key)
+        location = doc.get('location')
+        if not location or not location.get('coordinates'):
+            return
+        lon, lat = location['coordinates']
+        cell = _cell(lat, lon)
+        self._cells[cell][key] = (lat, lon, normalize_text(doc.get('company')), doc)
+        self._cell_of[key] = cell
+
+    def remove(self, key: str):
+        cell = self._cell_of.pop(str(key), None)
+        if cell is not None:
+            entries = self._cells[cell]
+            entries.pop(str(key), None)
+            if not entries:
+                del self._cells[cell]
+
+    def nearest(self, lat: float, lon: float, k: int = 10, company: str = None) -> list:
+        """Return up to k (distance_km, document) pairs, closest first"""
+        company = normalize_text(company)
+        row, col = _cell(lat, lon)
+        found = []     # (distance, key, doc)
+        last_ring = max((max(abs(r - row), abs(c - col)) for r, c in self._cells), default=0)
+        for ring in range(last_ring + 1):
+            for cell in self._ring(row, col, ring):
+                entries = self._cells.get(cell)
+                if not entries:
+                    continue
+                for key, (doc_lat, doc_lon, doc_company, doc) in entries.items():
+                    if company and company not in doc_company:
+                        continue
+                    found.append((haversine_km(lat, lon, doc_lat, doc_lon), key, doc))
+            if len(found) >= k:
+                found.sort(key=lambda item: item[:2])
+                del found[k:]
+                if found[-1][0] <= self._ring_clearance(lat, ring):
+                    break
+        found.sort(key=lambda item: item[:2])
+        return [(distance, doc) for distance, _, doc in found[:k]]
+
+    @staticmethod
+    def _ring(row: int, col: int, ring: int):
+        if ring == 0:
+            yield row, col
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield row - ring, c
+            yield row + ring, c
+        for r in range(row - ring + 1, row + ring):
+            yield r, col - ring
+            yield r, col + ring
+
+    @staticmethod
+    def _ring_clearance(lat: float, ring: int) -> float:
+        """Lower bound on the distance to any cell outside the scanned rings"""
+        edge_lat = min(89.0, abs(lat) + (ring + 1) * GRID_CELL_DEGREES)
+        return ring * GRID_CELL_DEGREES * KM_PER_DEGREE * math.cos(math.radians(edge_lat))
@@ -1,19 +1,56 @@
 #!/usr/bin/env python3
 """
 Script to import branch data from Excel files into MongoDB
+
+Workbooks are downloaded to disk in chunks and read in openpyxl's read-only
+mode, one row at a time, so memory stays flat no matter how large a sheet is.
+Rows are inserted in fixed-size batches as they are parsed.
+
+Re-imports are diffed row by row by default: every row gets a stable import
+key and content hash, only new or changed rows are written and rows that
+disappeared from the sheet are deleted afterwards. A carrier's branches
+never vanish from search mid-import and branch ids stay the same across
+runs. --mode replace restores the old delete-then-insert behaviour.
+
+With --concurrency N (N > 1) up to N companies are imported at once: each
+holds one of N slots from download to the last insert, its sheet is parsed
+in a process pool and its batches are inserted as soon as the worker hands
+them back, so the import takes about as long as the slowest companies
+instead of the sum of all of them. Every company in flight has its own
+parse worker and its own thread reading that worker's queue, so a full
+queue can never wait on a reader that has no thread. A company that fails
+stops its parse worker and is reported in the exit status.
 """
 
+import argparse
 import asyncio
+import contextlib
+import hashlib
+import json
+import multiprocessing
 import os
+import re
+import resource
 import sys
+import time
 import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from queue import Full
 import httpx
 from openpyxl import load_workbook
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from pathlib import Path
 
+from data_version import delete_branches, get_data_version, write_version
+from db_indexes import ensure_indexes
+from geo import location_fields
+from phones import phone_fields
+from search_keys import normalize_text, search_keys
+from pymongo import InsertOne, UpdateOne
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -46,141 +83,400 @@ COMPANY_LOGOS = {
     'Inter Global Kargo': '',
 }
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+INSERT_BATCH_SIZE = 1000
+# Batches a parse worker may run ahead of the inserts for its company
+PIPELINE_DEPTH = 4
+# How often a parse worker blocked on a full queue checks whether to stop
+STOP_POLL_SECONDS = 1.0
+DELETE_BATCH_SIZE = 1000
+
+# Branch ids are derived from the import key so they survive re-imports
+IMPORT_ID_NAMESPACE = uuid.UUID('6f1c2b9e-4d0a-4c55-9a57-0b8f3e2d7a41')
+CONTENT_FIELDS = ('name', 'company', 'city', 'district', 'address', 'phone',
+                  'google_maps_url', 'logo_url', 'working_hours', 'source_url')
+# Not in the sheets; updates leave what dedup.py merged in from other sources
+KEPT_ON_UPDATE = ('created_at', 'source_url', 'logo_url', 'working_hours')
+
 async def download_file(url: str, filename: str) -> str:
-    """Download a file from URL"""
+    """Download a file from URL, streaming it to disk in chunks"""
+    filepath = f"/tmp/{filename}"
     async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.get(url)
-        response.raise_for_status()
-        
-        filepath = f"/tmp/{filename}"
-        with open(filepath, 'wb') as f:
-            f.write(response.content)
-        return filepath
+        async with client.stream('GET', url) as response:
+            response.raise_for_status()
+            with open(filepath, 'wb') as f:
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+    return filepath
 
-def extract_branches_from_excel(filepath: str, company: str) -> list:
-    """Extract branch data from Excel file"""
-    branches = []
-    wb = load_workbook(filepath)
-    ws = wb.active
-    
-    # Get header row to understand column mapping
-    headers = []
-    for cell in ws[1]:
-        headers.append(str(cell.value).lower() if cell.value else '')
-    
-    print(f"Headers found for {company}: {headers}")
-    
-    # Try to map columns
-    name_col = None
-    city_col = None
-    district_col = None
-    address_col = None
-    phone_col = None
+def map_columns(headers: list) -> dict:
+    """Find the name/city/district/address/phone columns from header names"""
+    columns = {'name': None, 'city': None, 'district': None, 'address': None, 'phone': None}
     
     for i, h in enumerate(headers):
         h_lower = h.lower().strip()
         if 'sube_adi' in h_lower or 'şube' in h_lower or 'name' in h_lower:
-            name_col = i
+            columns['name'] = i
         elif 'sehir' in h_lower or 'şehir' in h_lower or 'city' in h_lower or h_lower == 'il':
-            city_col = i
+            columns['city'] = i
         elif 'ilce' in h_lower or 'ilçe' in h_lower or 'district' in h_lower:
-            district_col = i
+            columns['district'] = i
         elif 'adres' in h_lower or 'address' in h_lower:
-            address_col = i
+            columns['address'] = i
         elif 'telefon_1' in h_lower or 'telefon' in h_lower or 'phone' in h_lower:
-            phone_col = i
+            columns['phone'] = i
     
-    print(f"Column mapping: name={name_col}, city={city_col}, district={district_col}, address={address_col}, phone={phone_col}")
+    return columns
+
+def build_branch(values: tuple, columns: dict, company: str):
+    """Turn one sheet row into a branch document, or None for empty rows"""
+    def cell(field):
+        col = columns[field]
+        if col is None or col >= len(values) or not values[col]:
+            return ''
+        return str(values[col])
     
-    # Read data rows
-    for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
-        try:
-            # Get values with defaults
-            name = str(row[name_col].value) if name_col is not None and row[name_col].value else ''
-            city = str(row[city_col].value) if city_col is not None and row[city_col].value else ''
-            district = str(row[district_col].value) if district_col is not None and row[district_col].value else ''
-            address = str(row[address_col].value) if address_col is not None and row[address_col].value else ''
-            phone = str(row[phone_col].value) if phone_col is not None and row[phone_col].value else ''
-            
-            # Skip empty rows
-            if not name or name == 'None':
+    name = cell('name')
+    city = cell('city')
+    district = cell('district')
+    address = cell('address')
+    phone = cell('phone')
+    
+    # Skip empty rows
+    if not name or name == 'None':
+        return None
+    
+    # Clean up name - add company prefix if not present
+    if company.split()[0] not in name:
+        name = f"{company} {name}"
+    
+    # Create Google Maps URL
+    search_query = f"{name} {address} {city}"
+    google_maps_url = f"https://www.google.com/maps/search/?api=1&query={search_query.replace(' ', '+')}"
+    
+    branch = {
+        'name': name.strip(),
+        'company': company,
+        'city': city.strip(),
+        'district': district.strip(),
+        'address': address.strip(),
+        'phone': phone.strip(),
+        'google_maps_url': google_maps_url,
+        'logo_url': '',
+        'working_hours': {},
+        'source_url': '',
+        'created_at': datetime.utcnow()
+    }
+    branch['search'] = search_keys(branch)
+    branch.update(location_fields(branch))
+    branch.update(phone_fields(branch))
+    return branch
+
+def iter_branches_from_excel(filepath: str, company: str):
+    """Yield branch documents from an Excel file one row at a time"""
+    wb = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        rows = ws.iter_rows(values_only=True)
+        
+        # Get header row to understand column mapping
+        header_row = next(rows, ())
+        headers = [str(v).lower() if v else '' for v in header_row]
+        print(f"Headers found for {company}: {headers}")
+        
+        columns = map_columns(headers)
+        print("Column mapping: " + ", ".join(f"{k}={v}" for k, v in columns.items()))
+        
+        # Read data rows
+        for row_idx, values in enumerate(rows, start=2):
+            try:
+                branch = build_branch(values, columns, company)
+            except Exception as e:
+                print(f"Error processing row {row_idx}: {e}")
                 continue
-            
-            # Clean up name - add company prefix if not present
-            if company.split()[0] not in name:
-                name = f"{company} {name}"
-            
-            # Create Google Maps URL
-            search_query = f"{name} {address} {city}"
-            google_maps_url = f"https://www.google.com/maps/search/?api=1&query={search_query.replace(' ', '+')}"
-            
-            branch = {
-                'id': str(uuid.uuid4()),
-                'name': name.strip(),
-                'company': company,
-                'city': city.strip(),
-                'district': district.strip(),
-                'address': address.strip(),
-                'phone': phone.strip(),
-                'google_maps_url': google_maps_url,
-                'logo_url': '',
-                'working_hours': {},
-                'source_url': '',
-                'created_at': datetime.utcnow()
-            }
-            branches.append(branch)
-            
-        except Exception as e:
-            print(f"Error processing row {row_idx}: {e}")
-            continue
+            if branch:
+                yield branch
+    finally:
+        # Read-only workbooks keep the file handle open until closed
+        wb.close()
+
+def extract_branches_from_excel(filepath: str, company: str) -> list:
+    """Extract branch data from Excel file"""
+    return list(iter_branches_from_excel(filepath, company))
+
+def batched(iterable, size: int):
+    """Yield lists of up to size items"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    return usage / (1024 * 1024) if sys.platform == 'darwin' else usage / 1024
+
+def assign_import_keys(batch: list, occurrences: Counter):
+    """Give each row a stable import key, branch id and content hash
     
-    return branches
+    The key is company + normalized name/city/district; repeated rows within
+    one sheet get an occurrence suffix so they stay distinct.
+    """
+    for branch in batch:
+        base = '|'.join(normalize_text(branch[f]) for f in ('company', 'name', 'city', 'district'))
+        occurrences[base] += 1
+        key = base if occurrences[base] == 1 else f"{base}#{occurrences[base]}"
+        content = json.dumps([branch[f] for f in CONTENT_FIELDS], ensure_ascii=False, sort_keys=True)
+        branch['import_key'] = key
+        branch['id'] = str(uuid.uuid5(IMPORT_ID_NAMESPACE, key))
+        branch['content_hash'] = hashlib.sha1(content.encode()).hexdigest()
 
-async def import_branches():
-    """Main import function"""
-    total_imported = 0
+def import_key_query(company: str) -> dict:
+    """Rows imported from a company's sheet, whatever their company field says now"""
+    return {'import_key': {'$regex': f"^{re.escape(normalize_text(company))}\\|"}}
+
+async def replace_company(company: str, batches) -> dict:
+    """Delete the company's branches, then insert the new rows"""
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+    occurrences = Counter()
+    async for batch in batches:
+        assign_import_keys(batch, occurrences)
+        if counts['inserted'] == 0:
+            # First delete existing branches for this company
+            counts['deleted'] = await delete_branches(db, {'$or': [{'company': company}, import_key_query(company)]})
+            print(f"Deleted {counts['deleted']} existing {company} branches")
+        
+        # Insert new branches
+        async with write_version(db) as version:
+            for branch in batch:
+                branch['updated_version'] = version
+            result = await db.branches.insert_many(batch, ordered=False)
+        counts['inserted'] += len(result.inserted_ids)
+    return counts
+
+async def diff_company(company: str, batches) -> dict:
+    """Write only new/changed rows, then delete rows missing from the sheet"""
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+    occurrences = Counter()
+    
+    existing = {}
+    cursor = db.branches.find(import_key_query(company), {'import_key': 1, 'content_hash': 1})
+    async for doc in cursor:
+        existing[doc['import_key']] = (doc['_id'], doc.get('content_hash'))
+    # Sheet rows dedup.py merged into another branch are already stored there
+    merged = set()
+    async for doc in db.branches.find({'merged_import_keys': {'$exists': True}}, {'merged_import_keys': 1}):
+        merged.update(doc['merged_import_keys'])
+    seen = set()
     
-    for company, url in EXCEL_FILES.items():
-        print(f"\n{'='*50}")
-        print(f"Processing {company}...")
-        print(f"{'='*50}")
+    async for batch in batches:
+        assign_import_keys(batch, occurrences)
+        # (existing _id or None for a new row, branch) for each row to write
+        changed = []
+        for branch in batch:
+            key = branch['import_key']
+            seen.add(key)
+            current = existing.get(key)
+            if current is None and key in merged:
+                counts['unchanged'] += 1
+            elif current is None:
+                changed.append((None, branch))
+                counts['inserted'] += 1
+            elif current[1] != branch['content_hash']:
+                changed.append((current[0], branch))
+                counts['updated'] += 1
+            else:
+                counts['unchanged'] += 1
+        if changed:
+            async with write_version(db) as version:
+                ops = []
+                for doc_id, branch in changed:
+                    branch['updated_version'] = version
+                    if doc_id is None:
+                        ops.append(InsertOne(branch))
+                    else:
+                        fields = {k: v for k, v in branch.items() if k not in KEPT_ON_UPDATE}
+                        ops.append(UpdateOne({'_id': doc_id}, {'$set': fields}))
+                await db.branches.bulk_write(ops, ordered=False)
+    
+    if not seen:
+        # An empty or unreadable sheet must not wipe the carrier
+        return counts
+    
+    stale_ids = [doc_id for key, (doc_id, _) in existing.items() if key not in seen]
+    for i in range(0, len(stale_ids), DELETE_BATCH_SIZE):
+        counts['deleted'] += await delete_branches(db, {'_id': {'$in': stale_ids[i:i + DELETE_BATCH_SIZE]}})
+    
+    # Rows from imports that predate import keys; scraped, bulk-ingested
+    # and seeded branches are kept
+    counts['deleted'] += await delete_branches(db, {
+        'company': company,
+        'import_key': {'$exists': False},
+        'source_url': {'$in': ['', None]},
+        'origin': {'$exists': False}
+    })
+    return counts
+
+def parse_to_queue(filepath: str, company: str, queue, stop, batch_size: int):
+    """Process pool worker: parse a sheet and hand batches back through queue
+    
+    Gives up as soon as ``stop`` is set, i.e. the importer stopped reading,
+    so a failed company never leaves a worker blocked on its full queue.
+    """
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=STOP_POLL_SECONDS)
+                return True
+            except Full:
+                pass
+        return False
+    
+    try:
+        for batch in batched(iter_branches_from_excel(filepath, company), batch_size):
+            if not put(batch):
+                return
+    finally:
+        if not put(None):
+            # Release a reader still waiting in get
+            with contextlib.suppress(Full):
+                queue.put_nowait(None)
+
+async def local_batches(filepath: str, company: str):
+    """Parse a sheet in this process"""
+    for batch in batched(iter_branches_from_excel(filepath, company), INSERT_BATCH_SIZE):
+        yield batch
+
+async def pooled_batches(filepath: str, company: str, executor, manager, readers):
+    """Parse a sheet in the process pool, yielding batches as they arrive
+    
+    ``readers`` is a thread pool with a thread for every company in flight;
+    the default executor may be busy, and a parse blocked on its full queue
+    would then never be drained.
+    """
+    loop = asyncio.get_running_loop()
+    queue = manager.Queue(maxsize=PIPELINE_DEPTH)
+    stop = manager.Event()
+    parsing = loop.run_in_executor(executor, parse_to_queue, filepath, company, queue, stop, INSERT_BATCH_SIZE)
+    try:
+        while True:
+            batch = await loop.run_in_executor(readers, queue.get)
+            if batch is None:
+                break
+            yield batch
+    finally:
+        # The caller may stop reading early, e.g. after a failed write;
+        # the worker then gives up and frees its pool slot
+        stop.set()
+        await asyncio.gather(parsing, return_exceptions=True)
+    # Surface any exception raised while parsing
+    parsing.result()
+
+async def import_company(company: str, url: str, executor=None, manager=None, readers=None,
+                         mode: str = 'diff') -> int:
+    """Download, parse and store one company's branches; returns rows written"""
+    print(f"\n{'='*50}")
+    print(f"Processing {company}...")
+    print(f"{'='*50}")
+    
+    # Download file
+    filename = f"{company.replace(' ', '_')}.xlsx"
+    filepath = await download_file(url, filename)
+    print(f"Downloaded {company} to {filepath}")
+    
+    try:
+        if executor is not None:
+            batches = pooled_batches(filepath, company, executor, manager, readers)
+        else:
+            batches = local_batches(filepath, company)
+        
+        # Stream branches out of the sheet in fixed-size batches
+        started = time.perf_counter()
+        store = replace_company if mode == 'replace' else diff_company
+        async with contextlib.aclosing(batches):
+            counts = await store(company, batches)
         
+        elapsed = time.perf_counter() - started
+        rows = counts['inserted'] + counts['updated'] + counts['unchanged']
+        rate = rows / elapsed if elapsed > 0 else 0
+        print(f"{company}: {counts['inserted']} inserted, {counts['updated']} updated, "
+              f"{counts['unchanged']} unchanged, {counts['deleted']} deleted in {elapsed:.2f}s "
+              f"({rate:.0f} rows/s, peak RSS {peak_rss_mb():.1f} MiB)")
+        return counts['inserted'] + counts['updated']
+    finally:
+        # Cleanup
+        os.remove(filepath)
+
+async def import_branches(concurrency: int = 1, mode: str = 'diff') -> list:
+    """Main import function; returns the companies that failed"""
+    total_imported = 0
+    failed = []
+    started = time.perf_counter()
+    
+    await ensure_indexes(db)
+    
+    async def run(company, url, **kwargs):
         try:
-            # Download file
-            filename = f"{company.replace(' ', '_')}.xlsx"
-            filepath = await download_file(url, filename)
-            print(f"Downloaded to {filepath}")
-            
-            # Extract branches
-            branches = extract_branches_from_excel(filepath, company)
-            print(f"Extracted {len(branches)} branches")
-            
-            if branches:
-                # First delete existing branches for this company
-                delete_result = await db.branches.delete_many({'company': company})
-                print(f"Deleted {delete_result.deleted_count} existing {company} branches")
-                
-                # Insert new branches
-                result = await db.branches.insert_many(branches)
-                print(f"Inserted {len(result.inserted_ids)} branches for {company}")
-                total_imported += len(result.inserted_ids)
-            
-            # Cleanup
-            os.remove(filepath)
-            
+            return await import_company(company, url, **kwargs)
         except Exception as e:
             print(f"Error processing {company}: {e}")
             import traceback
             traceback.print_exc()
-            continue
+            failed.append(company)
+            return 0
+    
+    if concurrency > 1:
+        # A slot covers a company's download, parse and inserts, so at most
+        # `concurrency` parses and queue readers are ever in flight
+        slots = asyncio.Semaphore(concurrency)
+        
+        async def run_in_slot(company, url, **kwargs):
+            async with slots:
+                return await run(company, url, **kwargs)
+        
+        # The manager shuts down first: a worker or reader still blocked on
+        # one of its queues then fails instead of hanging the pools' exit
+        with ProcessPoolExecutor(max_workers=concurrency) as executor, \
+                ThreadPoolExecutor(max_workers=concurrency) as readers, \
+                multiprocessing.Manager() as manager:
+            counts = await asyncio.gather(*[
+                run_in_slot(company, url, executor=executor, manager=manager, readers=readers, mode=mode)
+                for company, url in EXCEL_FILES.items()
+            ])
+        total_imported = sum(counts)
+    else:
+        for company, url in EXCEL_FILES.items():
+            total_imported += await run(company, url, mode=mode)
     
     print(f"\n{'='*50}")
-    print(f"TOTAL IMPORTED: {total_imported} branches")
+    print(f"TOTAL WRITTEN: {total_imported} branches in {time.perf_counter() - started:.2f}s")
     print(f"{'='*50}")
     
+    # The API server rebuilds its search index when it sees the new version
+    print(f"Branch data version is now {await get_data_version(db)}")
+    
     # Get total count in database
     total_count = await db.branches.count_documents({})
     print(f"Total branches in database: {total_count}")
+    
+    if failed:
+        print(f"FAILED: {', '.join(failed)}")
+    return failed
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import branch data from Excel files into MongoDB")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="companies to import in parallel (1 = one after another)")
+    parser.add_argument('--mode', choices=['diff', 'replace'], default='diff',
+                        help="diff: write only changed rows (default); replace: delete and re-insert")
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    asyncio.run(import_branches())
+    args = parse_args()
+    failed = asyncio.run(import_branches(concurrency=args.concurrency, mode=args.mode))
+    sys.exit(1 if failed else 0)
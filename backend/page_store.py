@@ -0,0 +1,111 @@
+"""
+Content-addressed store for fetched branch pages.
+
+The crawler keeps the raw bytes of every page it fetches, compressed, under
+the SHA-256 of those bytes; the crawl_state collection already maps each URL
+to the hash of its latest content, so together they form a local copy of the
+site. Changes to the extraction rules can then be tried by re-parsing the
+stored pages (``python crawler.py --reparse``) without fetching anything.
+
+Blobs are zstd-compressed when the zstandard module is installed and gzip
+otherwise; the file extension records which, so stores written either way
+stay readable. Each blob starts with a ``charset=<name>`` line giving the
+encoding the crawler decoded the response with, so a re-parse sees the same
+text; blobs without that line are UTF-8. Identical pages are stored once.
+"""
+
+import gzip
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # optional: gzip-only without it
+    zstandard = None
+
+PAGE_STORE_DIR = os.environ.get('PAGE_STORE_DIR', str(Path(__file__).parent / 'page_store'))
+CODECS = ('.zst', '.gz')
+CHARSET_HEADER = b'charset='
+
+
+def compress(content: bytes) -> tuple:
+    """(extension, compressed bytes) with the best available codec"""
+    if zstandard is not None:
+        return '.zst', zstandard.ZstdCompressor(level=10).compress(content)
+    return '.gz', gzip.compress(content, compresslevel=6)
+
+
+def pack(content: bytes, encoding: str) -> bytes:
+    return CHARSET_HEADER + encoding.encode('ascii') + b'\n' + content
+
+
+def unpack(data: bytes) -> tuple:
+    """(encoding, page bytes) of a decompressed blob"""
+    if data.startswith(CHARSET_HEADER):
+        header, _, content = data.partition(b'\n')
+        return header[len(CHARSET_HEADER):].decode('ascii'), content
+    return 'utf-8', data
+
+
+def read_blob(path: str) -> tuple:
+    """(encoding, page bytes) stored at path"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"{path} is zstd-compressed but zstandard is not installed")
+        return unpack(zstandard.ZstdDecompressor().decompress(data))
+    return unpack(gzip.decompress(data))
+
+
+def read_page(path: str) -> str:
+    """Stored page as text, decoded with the charset the crawler used"""
+    encoding, content = read_blob(path)
+    return content.decode(encoding, errors='replace')
+
+
+class PageStore:
+    """Compressed page blobs on disk, keyed by content hash"""
+
+    def __init__(self, root: str = PAGE_STORE_DIR):
+        self.root = Path(root)
+
+    def _base(self, content_hash: str) -> Path:
+        return self.root / content_hash[:2] / content_hash
+
+    def path(self, content_hash: str) -> Optional[Path]:
+        """Path of the stored blob, or None if the page is not stored"""
+        base = self._base(content_hash)
+        for ext in CODECS:
+            path = base.with_suffix(ext)
+            if path.exists():
+                return path
+        return None
+
+    def __contains__(self, content_hash: str) -> bool:
+        return self.path(content_hash) is not None
+
+    def put(self, content_hash: str, content: bytes, encoding: str = 'utf-8') -> bool:
+        """Store a page and its charset unless it is already there; True if it was written"""
+        if content_hash in self:
+            return False
+        ext, data = compress(pack(content, encoding))
+        path = self._base(content_hash).with_suffix(ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so a crash never leaves a truncated blob behind
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return True
+
+    def get(self, content_hash: str) -> Optional[tuple]:
+        """(encoding, page bytes), or None if the page is not stored"""
+        path = self.path(content_hash)
+        return read_blob(str(path)) if path is not None else None
@@ -0,0 +1,49 @@
+"""
+Turkish phone numbers in E.164 form.
+
+Sheets and scraped pages store ``phone`` as typed ("0 216 345 67 89",
+"(0216) 3456789", "0216 345 67 89 / 0216 345 67 90"), so every write path
+also stores ``phones``: the E.164 form ("+902163456789") of each number in
+it. The field carries an index (see db_indexes.py) and reverse lookups are
+an exact match on one normalized number.
+"""
+
+import re
+
+COUNTRY_CODE = '90'
+NUMBER_SEPARATORS = re.compile(r'[/,;|]|\bveya\b')
+
+
+def normalize_phone(number) -> str:
+    """E.164 form of one Turkish number, or '' if it is not one
+
+    Accepts national (0XXX...), international (+90/0090) and bare ten-digit
+    numbers, plus seven-digit 444 call-centre numbers.
+    """
+    digits = ''.join(c for c in str(number or '') if c.isdigit())
+    if digits.startswith('00'):
+        digits = digits[2:]
+    if len(digits) == 12 and digits.startswith(COUNTRY_CODE):
+        digits = digits[2:]
+    elif len(digits) == 11 and digits.startswith('0'):
+        digits = digits[1:]
+    if len(digits) == 10 and digits[0] in '23458':
+        return f'+{COUNTRY_CODE}{digits}'
+    if len(digits) == 7 and digits.startswith('444'):
+        return f'+{COUNTRY_CODE}{digits}'
+    return ''
+
+
+def phone_numbers(phone) -> list:
+    """E.164 numbers found in a stored phone string, in order, without repeats"""
+    numbers = []
+    for part in NUMBER_SEPARATORS.split(str(phone or '')):
+        number = normalize_phone(part)
+        if number and number not in numbers:
+            numbers.append(number)
+    return numbers
+
+
+def phone_fields(branch: dict) -> dict:
+    """``phones`` for a branch document"""
+    return {'phones': phone_numbers(branch.get('phone'))}
@@ -0,0 +1,193 @@
+"""
+Background scrape jobs.
+
+Crawls run outside request handling: POST /api/scrape/jobs stores a job in
+the ``scrape_jobs`` collection, and a fixed number of asyncio workers per
+API process claim queued jobs and run them one at a time each. The crawl
+statistics are written back to the job document every few seconds so any
+process can report progress.
+
+A job is claimed atomically, recording the claiming process as ``owner``
+with a lease that every progress write extends. Workers in any process
+pick up queued jobs and jobs whose lease ran out, i.e. whose owner died,
+so running jobs of a live process are never run twice. A process shutting
+down hands its running jobs back to the queue; crawls are incremental, so
+a resumed job skips the pages already stored.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+LEASE_SECONDS = 60
+POLL_SECONDS = 5.0      # how often idle workers look for jobs from other processes
+
+
+class QueueFullError(Exception):
+    """Too many jobs are waiting already"""
+
+
+def job_view(doc: dict) -> dict:
+    """Job document as returned by the API"""
+    view = {k: v for k, v in doc.items() if k not in ('_id', 'lease_until')}
+    view['id'] = doc['_id']
+    return view
+
+
+class ScrapeJobQueue:
+    """Bounded pool of workers running crawl jobs stored in MongoDB
+
+    ``make_crawler(params)`` returns a BranchCrawler for a job's parameters;
+    ``on_finished(stats)`` is awaited after every job that wrote branches.
+    """
+
+    def __init__(self, db, make_crawler, on_finished=None, workers: int = 1,
+                 max_pending: int = 20, progress_interval: float = 2.0):
+        self.db = db
+        self.make_crawler = make_crawler
+        self.on_finished = on_finished
+        self.workers = workers
+        self.max_pending = max_pending
+        self.progress_interval = progress_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    async def start(self):
+        await self.db.scrape_jobs.create_index([('status', ASCENDING), ('created_at', ASCENDING)])
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers, handing their running jobs back to the queue"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, params: dict) -> dict:
+        """Store and queue a new crawl (or reparse) job"""
+        pending = await self.db.scrape_jobs.count_documents({'status': QUEUED})
+        if pending >= self.max_pending:
+            raise QueueFullError(f"{pending} scrape jobs are already waiting")
+        doc = {
+            '_id': str(uuid.uuid4()),
+            'kind': 'reparse' if params.get('reparse') else 'crawl',
+            'params': params,
+            'status': QUEUED,
+            'owner': None,
+            'lease_until': None,
+            'created_at': datetime.utcnow(),
+            'started_at': None,
+            'finished_at': None,
+            'attempts': 0,
+            'progress': {},
+            'error': None,
+        }
+        await self.db.scrape_jobs.insert_one(doc)
+        self._wakeup.set()
+        return doc
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.db.scrape_jobs.find_one({'_id': job_id})
+
+    async def recent(self, limit: int = 20) -> list:
+        cursor = self.db.scrape_jobs.find({}).sort('created_at', DESCENDING).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    def _lease(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+
+    async def _claim(self) -> Optional[dict]:
+        """Take the oldest queued job, or one whose owner's lease expired"""
+        now = datetime.utcnow()
+        return await self.db.scrape_jobs.find_one_and_update(
+            {'$or': [{'status': QUEUED}, {'status': RUNNING, 'lease_until': {'$lt': now}}]},
+            {'$set': {'status': RUNNING, 'owner': self.owner, 'lease_until': self._lease(), 'started_at': now},
+             '$inc': {'attempts': 1}},
+            sort=[('created_at', ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _worker(self):
+        while True:
+            try:
+                doc = await self._claim()
+            except Exception as e:
+                logger.error(f"Claiming a scrape job failed: {e}")
+                doc = None
+            if doc is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(doc)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scrape job {doc['_id']} crashed: {e}")
+
+    async def _save(self, job_id: str, fields: dict) -> bool:
+        """Update a job this process owns; False if the lease was lost"""
+        result = await self.db.scrape_jobs.update_one(
+            {'_id': job_id, 'owner': self.owner, 'status': RUNNING}, {'$set': fields})
+        return result.matched_count > 0
+
+    async def _run(self, doc: dict):
+        job_id = doc['_id']
+        params = doc['params']
+        crawler = self.make_crawler(params)
+        if params.get('reparse'):
+            work = crawler.reparse(urls=params.get('urls'), max_urls=params.get('max_urls'))
+        else:
+            work = crawler.run(
+                sitemap_indexes=params.get('sitemap_indexes'),
+                max_urls=params.get('max_urls'),
+                urls=params.get('urls'),
+            )
+        crawl = asyncio.create_task(work)
+        final = {'status': FAILED, 'error': 'interrupted'}
+        try:
+            # Report progress and renew the lease until the crawl ends
+            while not crawl.done():
+                await asyncio.wait([crawl], timeout=self.progress_interval)
+                if not crawl.done():
+                    if not await self._save(job_id, {'progress': crawler.stats.to_dict(),
+                                                     'lease_until': self._lease()}):
+                        logger.error(f"Scrape job {job_id} lease lost, stopping it")
+                        final = None
+                        return
+            stats = crawl.result()
+            if self.on_finished is not None and (stats.upserted or stats.modified):
+                await self.on_finished(stats)
+            final = {'status': SUCCEEDED, 'error': None}
+        except asyncio.CancelledError:
+            # Shutdown: another worker resumes the job
+            final = {'status': QUEUED, 'owner': None, 'lease_until': None}
+            raise
+        except Exception as e:
+            logger.error(f"Scrape job {job_id} failed: {e}")
+            final = {'status': FAILED, 'error': str(e)}
+        finally:
+            if not crawl.done():
+                crawl.cancel()
+                await asyncio.gather(crawl, return_exceptions=True)
+            if final is not None:
+                if final['status'] != QUEUED:
+                    final['finished_at'] = datetime.utcnow()
+                await asyncio.shield(self._save(job_id, {**final, 'progress': crawler.stats.to_dict()}))
@@ -0,0 +1,51 @@
+"""
+Turkish-aware search keys for branch documents.
+
+MongoDB's case-insensitive regex does not fold ı/İ/ş/ç/ğ/ü/ö, so "kadikoy"
+never matched "Kadıköy". Every write path stores an ASCII-folded, lowercase
+copy of the searchable fields under ``search``, which the in-memory indexes
+and their MongoDB fallback match queries against.
+"""
+
+import re
+
+SEARCH_KEY_FIELDS = ('name', 'address', 'city', 'district', 'company')
+
+TURKISH_FOLD = str.maketrans({
+    'ı': 'i', 'İ': 'i', 'I': 'i',
+    'ş': 's', 'Ş': 's',
+    'ç': 'c', 'Ç': 'c',
+    'ğ': 'g', 'Ğ': 'g',
+    'ü': 'u', 'Ü': 'u',
+    'ö': 'o', 'Ö': 'o',
+    'â': 'a', 'Â': 'a',
+    'î': 'i', 'Î': 'i',
+    'û': 'u', 'Û': 'u',
+    '̇': None,  # combining dot left over from lowercasing İ
+})
+
+TOKEN_SPLIT = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_text(text) -> str:
+    """Fold Turkish characters to ASCII, lowercase and collapse whitespace"""
+    if not text:
+        return ''
+    return ' '.join(str(text).translate(TURKISH_FOLD).lower().split())
+
+
+def tokenize(text) -> list:
+    """Split normalized text into alphanumeric tokens"""
+    return [t for t in TOKEN_SPLIT.split(normalize_text(text)) if t]
+
+
+def search_keys(branch: dict) -> dict:
+    """Build the ``search`` sub-document stored alongside a branch"""
+    keys = {field: normalize_text(branch.get(field)) for field in SEARCH_KEY_FIELDS}
+    tokens = []
+    for field in SEARCH_KEY_FIELDS:
+        for token in TOKEN_SPLIT.split(keys[field]):
+            if token and token not in tokens:
+                tokens.append(token)
+    keys['tokens'] = tokens
+    return keys
@@ -1,19 +1,39 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
+from pymongo import UpdateOne
 from typing import List, Optional
 import uuid
 from datetime import datetime
 import httpx
-import xml.etree.ElementTree as ET
-from bs4 import BeautifulSoup
 import asyncio
 import re
+import base64
+import json
+import orjson
+import csv
+import io
+import zlib
+from bson import ObjectId
+
+from branch_index import BranchIndex, sort_key
+from caching import LRUCache, StaticPayload, VersionedCache
+from crawler import BranchCrawler, CRAWL_BASE_URL, SITEMAP_COUNT, branch_update, parse_sitemap, sitemap_url
+from extractor import ExtractorPool
+from scrape_jobs import QueueFullError, ScrapeJobQueue, job_view
+from data_version import get_data_version, write_version
+from db_indexes import ensure_indexes, backfill_locations, backfill_phones, backfill_search_keys
+from geo import GeoGrid, haversine_km, location_fields
+from page_store import PageStore
+from phones import normalize_phone, phone_fields
+from search_keys import SEARCH_KEY_FIELDS, normalize_text, search_keys
+from suggest_index import SuggestIndex
 
 
 ROOT_DIR = Path(__file__).parent
@@ -72,9 +92,64 @@ class HelpTopic(BaseModel):
 
 class BranchSearchResponse(BaseModel):
     branches: List[Branch]
-    total: int
+    total: Optional[int] = None
     page: int
     limit: int
+    next_cursor: Optional[str] = None
+    facets: Optional[dict] = None
+
+MAX_BATCH_IDS = 500
+
+class BranchBatchRequest(BaseModel):
+    ids: List[str] = Field(..., max_length=MAX_BATCH_IDS)
+
+BULK_BATCH_SIZE = 1000
+MAX_BULK_LINE_BYTES = 64 * 1024
+MAX_BULK_ERRORS = 100
+BULK_KEY_FIELDS = ("company", "city", "district", "name")
+
+def branch_bulk_upsert(branch: dict, version: int) -> UpdateOne:
+    """Upsert keyed on source_url, or on the folded company/city/district/name
+    
+    Rows it creates are marked with origin "bulk" so spreadsheet imports
+    do not take them for their own legacy rows.
+    """
+    update = branch_update(branch, version)
+    update["$setOnInsert"]["origin"] = "bulk"
+    if branch["source_url"]:
+        key = {"source_url": branch["source_url"]}
+    else:
+        search = update["$set"]["search"]
+        key = {f"search.{field}": search[field] for field in BULK_KEY_FIELDS}
+    return UpdateOne(key, update, upsert=True)
+
+# Fields needed to render a branch in list responses; working_hours and
+# source_url are only served by the detail endpoint.
+BRANCH_LIST_PROJECTION = {
+    "id": 1, "name": 1, "company": 1, "city": 1, "district": 1, "address": 1,
+    "phone": 1, "google_maps_url": 1, "logo_url": 1, "created_at": 1,
+    "location": 1, "location_source": 1
+}
+
+def branch_list_row(b: dict) -> dict:
+    """Serialize a branch document like Branch(by_alias) without building the model
+    
+    Fields left out by BRANCH_LIST_PROJECTION come back as their defaults.
+    """
+    return {
+        "id": str(b.get("_id", b.get("id"))),
+        "Sube_Adi": b.get("name", ""),
+        "Sirket_Adi": b.get("company", ""),
+        "Sehir": b.get("city", ""),
+        "Ilce": b.get("district", ""),
+        "Adres": b.get("address", ""),
+        "Telefon_1": b.get("phone", ""),
+        "working_hours": b.get("working_hours") or {},
+        "google_maps_url": b.get("google_maps_url", ""),
+        "logo_url": b.get("logo_url", ""),
+        "source_url": b.get("source_url", ""),
+        "created_at": b.get("created_at") or datetime.utcnow()
+    }
 
 # ============ HELP TOPICS DATA ============
 
@@ -341,6 +416,110 @@ Bu tür gönderilerde kargo firmasının tazminat sorumluluğu yasal olarak orta
     }
 ]
 
+# Help topics never change at runtime, so both endpoints serve this snapshot
+# without touching MongoDB or re-serializing anything.
+
+def help_topic_detail(topic: dict) -> dict:
+    return {
+        "id": topic["id"],
+        "title": topic["title"],
+        "short_description": topic["short_description"],
+        "content": topic["content"],
+        "icon": topic.get("icon", "help-circle")
+    }
+
+HELP_TOPICS_BY_ID = {t["id"]: StaticPayload(help_topic_detail(t)) for t in HELP_TOPICS_DATA}
+
+HELP_TOPICS_LIST = StaticPayload({
+    "topics": [
+        {
+            "id": t["id"],
+            "title": t["title"],
+            "short_description": t["short_description"],
+            "icon": t.get("icon", "help-circle")
+        }
+        for t in sorted(HELP_TOPICS_DATA, key=lambda t: t.get("order", 0))
+    ]
+})
+
+async def seed_help_topics():
+    """Keep the help_topics collection in step with HELP_TOPICS_DATA"""
+    await db.help_topics.bulk_write(
+        [UpdateOne({"id": t["id"]}, {"$set": t}, upsert=True) for t in HELP_TOPICS_DATA],
+        ordered=False
+    )
+
+# ============ SCRAPING ============
+
+# HTML parsing runs here so it never blocks request handling
+extractor_pool = ExtractorPool()
+# Raw pages from crawls, for re-parsing without re-fetching
+page_store = PageStore()
+
+SCRAPE_JOB_WORKERS = int(os.environ.get('SCRAPE_JOB_WORKERS', '1'))
+SCRAPE_JOB_MAX_PENDING = int(os.environ.get('SCRAPE_JOB_MAX_PENDING', '20'))
+MAX_JOB_URLS = 1000
+
+def make_crawler(params: dict) -> BranchCrawler:
+    return BranchCrawler(db, base_url=CRAWL_BASE_URL, concurrency=params.get('concurrency', 16),
+                         extractor=extractor_pool, incremental=not params.get('full', False),
+                         store=page_store)
+
+# Crawls run here, outside request handling
+scrape_jobs = ScrapeJobQueue(db, make_crawler, on_finished=lambda stats: branches_changed(),
+                             workers=SCRAPE_JOB_WORKERS, max_pending=SCRAPE_JOB_MAX_PENDING)
+
+# ============ SEARCH INDEX ============
+
+INDEX_REFRESH_SECONDS = float(os.environ.get('INDEX_REFRESH_SECONDS', '30'))
+
+branch_index: Optional[BranchIndex] = None
+branch_index_version: Optional[int] = None
+suggest_index: Optional[SuggestIndex] = None
+geo_index: Optional[GeoGrid] = None
+index_refresh_task: Optional[asyncio.Task] = None
+
+# /companies, /cities and /stats payloads, keyed on branch_index_version
+listing_cache = VersionedCache()
+
+# /branches results, keyed on the normalized query plus branch_index_version
+search_cache = LRUCache(
+    maxsize=int(os.environ.get('SEARCH_CACHE_SIZE', '2048')),
+    ttl=float(os.environ.get('SEARCH_CACHE_TTL', '300'))
+)
+
+# /branches/snapshot bodies, keyed on the data version they were read at
+snapshot_cache = LRUCache(maxsize=2, ttl=float(os.environ.get('SNAPSHOT_CACHE_TTL', '86400')))
+SNAPSHOT_BROTLI_QUALITY = 9
+
+async def refresh_branch_index(force: bool = False):
+    """Rebuild the in-memory branch index if the data version has changed"""
+    global branch_index, branch_index_version, suggest_index, geo_index
+    
+    version = await get_data_version(db)
+    if not force and branch_index is not None and version == branch_index_version:
+        return
+    
+    docs = await db.branches.find({}, BRANCH_LIST_PROJECTION).to_list(length=None)
+    branch_index = await asyncio.to_thread(BranchIndex, docs)
+    suggest_index = await asyncio.to_thread(SuggestIndex, docs)
+    geo_index = await asyncio.to_thread(GeoGrid, docs)
+    branch_index_version = version
+    logger.info(f"Branch index built: {len(branch_index)} branches at data version {version}")
+
+async def index_refresh_loop():
+    """Pick up writes made by other processes, e.g. import_branches.py"""
+    while True:
+        await asyncio.sleep(INDEX_REFRESH_SECONDS)
+        try:
+            await refresh_branch_index()
+        except Exception as e:
+            logger.error(f"Branch index refresh failed: {e}")
+
+async def branches_changed():
+    """Bring the index up to date after a branch write"""
+    await refresh_branch_index(force=True)
+
 # ============ ROUTES ============
 
 @api_router.get("/")
@@ -353,263 +532,714 @@ async def health_check():
 
 # ---- Branch Routes ----
 
+def build_branch_query(search: Optional[str], city: Optional[str], company: Optional[str]) -> dict:
+    """Build the MongoDB query used when the search index is unavailable
+    
+    Matches exactly what the in-memory indexes match: every whitespace-
+    separated search word, folded, must be a substring of one of the folded
+    search keys, and city and company are substring matches on their own
+    key. Unanchored patterns scan the search key indexes rather than seek
+    in them, which is acceptable for the short window while the index builds.
+    """
+    query = {}
+    conditions = []
+    
+    for word in (search or "").split():
+        word = normalize_text(word)
+        if word:
+            conditions.append({"$or": [
+                {f"search.{field}": {"$regex": re.escape(word)}} for field in SEARCH_KEY_FIELDS
+            ]})
+    
+    if city and normalize_text(city):
+        conditions.append({"search.city": {"$regex": re.escape(normalize_text(city))}})
+    
+    if company and normalize_text(company):
+        conditions.append({"search.company": {"$regex": re.escape(normalize_text(company))}})
+    
+    if conditions:
+        query["$and"] = conditions
+    
+    return query
+
+def encode_cursor(key: tuple) -> str:
+    """Turn a (normalized name, _id) sort key into an opaque cursor"""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        name, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (str(name), str(key))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+FACET_LIMIT = 100
+
+def branch_facet_stages() -> dict:
+    """$facet sub-pipelines counting matches per company, city and district"""
+    def counts(field, key):
+        return [
+            {"$match": {field: {"$nin": [None, ""]}}},
+            {"$group": {"_id": key, "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": FACET_LIMIT}
+        ]
+    
+    return {
+        "company": counts("company", "$company"),
+        "city": counts("city", "$city"),
+        "district": counts("district", {"city": "$city", "district": "$district"})
+    }
+
+# Offline snapshot and delta rows: one array per branch in this column order
+SNAPSHOT_COLUMNS = (
+    "id", "name", "company", "city", "district", "address", "phone", "working_hours",
+    "google_maps_url", "logo_url", "lat", "lon", "location_source",
+    "search_name", "search_address", "search_city", "search_district", "search_company"
+)
+
+SNAPSHOT_PROJECTION = {
+    "name": 1, "company": 1, "city": 1, "district": 1, "address": 1, "phone": 1,
+    "working_hours": 1, "google_maps_url": 1, "logo_url": 1, "location": 1,
+    "location_source": 1, "search": 1
+}
+
+def snapshot_row(b: dict) -> list:
+    """Compact positional encoding of a branch, see SNAPSHOT_COLUMNS"""
+    keys = b.get("search") or search_keys(b)
+    lon, lat = (b.get("location") or {}).get("coordinates") or (None, None)
+    return [
+        str(b["_id"]), b.get("name", ""), b.get("company", ""), b.get("city", ""),
+        b.get("district", ""), b.get("address", ""), b.get("phone", ""), b.get("working_hours") or {},
+        b.get("google_maps_url", ""), b.get("logo_url", ""), lat, lon, b.get("location_source"),
+        keys["name"], keys["address"], keys["city"], keys["district"], keys["company"]
+    ]
+
 @api_router.get("/branches", response_model=BranchSearchResponse)
 async def get_branches(
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
     search: Optional[str] = None,
     city: Optional[str] = None,
-    company: Optional[str] = None
+    company: Optional[str] = None,
+    cursor: Optional[str] = None,
+    with_total: bool = True,
+    sort: str = Query("name", pattern="^(name|relevance)$"),
+    facets: bool = False
 ):
     """Get branches with pagination and optional filtering
     
     Search supports multiple words in any order:
     - "aras kargo milas" and "milas aras kargo" return the same results
     - Each word is searched across name, address, city, district, and company fields
+    
+    Results are ordered by normalized name. Pass the returned `next_cursor`
+    back as `cursor` to fetch the following page at constant cost (`page` is
+    ignored then); set `with_total=false` to skip counting matches.
+    
+    With `sort=relevance` matches are ranked by BM25 instead, and words may
+    be incomplete or contain a typo ("yurticii bakirky"). Ranked results are
+    paged with `page` only. Until the branch index is built, searches fall
+    back to MongoDB and are ordered by name.
+    
+    Set `facets=true` to also get company, city and district counts over
+    all matches (top 100 each), for building filter chips in the same
+    round trip.
+    
+    Searches are answered from the in-memory branch index; MongoDB is only
+    queried while the index is still being built. Responses are cached per
+    normalized query and data version, see /api/cache/stats.
+    
+    Rows are built straight from the projected documents and encoded with
+    orjson; the cache holds the encoded body. The shape matches
+    BranchSearchResponse, with working_hours and source_url left empty
+    (fetch /api/branches/{id} for those).
     """
-    query = {}
+    if cursor and sort == "relevance":
+        raise HTTPException(status_code=400, detail="Cursors are not supported with sort=relevance")
+    after = decode_cursor(cursor) if cursor else None
+    skip = 0 if after else (page - 1) * limit
+    words = search.strip().split() if search else []
     
-    if search:
-        # Split search into individual words and create AND condition for all words
-        words = search.strip().split()
-        if len(words) > 1:
-            # Multiple words: each word must match in any field (AND logic)
-            word_conditions = []
-            for word in words:
-                word_regex = {"$regex": word, "$options": "i"}
-                word_conditions.append({
-                    "$or": [
-                        {"name": word_regex},
-                        {"address": word_regex},
-                        {"city": word_regex},
-                        {"district": word_regex},
-                        {"company": word_regex}
-                    ]
-                })
-            query["$and"] = word_conditions
+    cache_key = (
+        branch_index_version,
+        sort,
+        tuple(normalize_text(w) for w in words),
+        normalize_text(city),
+        normalize_text(company),
+        after,
+        page,
+        limit,
+        with_total,
+        facets
+    )
+    
+    async def run_search():
+        total = None
+        facet_counts = None
+        if branch_index is not None and sort == "relevance":
+            branches, total = branch_index.ranked(words, city=city, company=company, skip=skip, limit=limit)
+            next_key = None
+            if not with_total:
+                total = None
+        elif branch_index is not None:
+            branches, next_key = branch_index.search(words, city=city, company=company, skip=skip, limit=limit, after=after)
+            if with_total:
+                total = branch_index.count(words, city=city, company=company)
         else:
-            # Single word: search across all fields
-            search_regex = {"$regex": search, "$options": "i"}
-            query["$or"] = [
-                {"name": search_regex},
-                {"address": search_regex},
-                {"city": search_regex},
-                {"district": search_regex},
-                {"company": search_regex}
-            ]
-    
-    if city:
-        query["city"] = {"$regex": city, "$options": "i"}
-    
-    if company:
-        query["company"] = {"$regex": company, "$options": "i"}
-    
-    skip = (page - 1) * limit
-    
-    total = await db.branches.count_documents(query)
-    branches_cursor = db.branches.find(query).skip(skip).limit(limit)
-    branches = await branches_cursor.to_list(length=limit)
-    
-    return BranchSearchResponse(
-        branches=[Branch(**{**b, "id": str(b.get("_id", b.get("id")))}) for b in branches],
-        total=total,
-        page=page,
-        limit=limit
+            query = build_branch_query(search, city, company)
+            if with_total:
+                total = await db.branches.count_documents(query)
+            if facets:
+                # Counts only: stages inside $facet cannot use an index, so paging stays a find
+                result = await db.branches.aggregate([{"$match": query}, {"$facet": branch_facet_stages()}]).to_list(length=1)
+                result = result[0]
+                facet_counts = {
+                    "company": [{"value": f["_id"], "count": f["count"]} for f in result["company"]],
+                    "city": [{"value": f["_id"], "count": f["count"]} for f in result["city"]],
+                    "district": [
+                        {"value": f["_id"]["district"], "city": f["_id"].get("city") or "", "count": f["count"]}
+                        for f in result["district"]
+                    ]
+                }
+            if after:
+                name, key = after
+                last_id = ObjectId(key) if ObjectId.is_valid(key) else key
+                query = {"$and": [query, {"$or": [
+                    {"search.name": {"$gt": name}},
+                    {"search.name": name, "_id": {"$gt": last_id}}
+                ]}]}
+            branches_cursor = db.branches.find(query, BRANCH_LIST_PROJECTION).sort([("search.name", 1), ("_id", 1)]).skip(skip).limit(limit + 1)
+            branches = await branches_cursor.to_list(length=limit + 1)
+            next_key = sort_key(branches[limit - 1]) if len(branches) > limit else None
+            branches = branches[:limit]
+        
+        if facets and branch_index is not None:
+            facet_counts = branch_index.facets(words, city=city, company=company, ranked=sort == "relevance")
+        
+        return orjson.dumps({
+            "branches": [branch_list_row(b) for b in branches],
+            "total": total,
+            "page": page,
+            "limit": limit,
+            "next_cursor": encode_cursor(next_key) if next_key else None,
+            **({"facets": facet_counts} if facets else {})
+        })
+    
+    if branch_index_version is None:
+        body = await run_search()
+    else:
+        body = await search_cache.get_or_compute(cache_key, run_search)
+    return Response(content=body, media_type="application/json")
+
+async def build_branch_snapshot(version: int) -> StaticPayload:
+    """Read every branch and encode the snapshot once"""
+    docs = await db.branches.find({}, SNAPSHOT_PROJECTION).to_list(length=None)
+    payload = {
+        "version": version,
+        "columns": SNAPSHOT_COLUMNS,
+        "rows": [snapshot_row(b) for b in docs]
+    }
+    return await asyncio.to_thread(StaticPayload, payload, SNAPSHOT_BROTLI_QUALITY)
+
+@api_router.get("/branches/snapshot")
+async def get_branch_snapshot(request: Request):
+    """Full branch directory for offline search in the app
+    
+    Rows are arrays in `columns` order and include the folded search keys.
+    Served compressed with an ETag; revalidate with If-None-Match and keep
+    up to date with /api/branches/changes?since=<version>.
+    """
+    # Read before the documents so later writes show up as changes
+    version = await get_data_version(db)
+    snapshot = await snapshot_cache.get_or_compute(version, lambda: build_branch_snapshot(version))
+    response = static_response(request, snapshot, cache_control="no-cache")
+    response.headers["X-Data-Version"] = str(version)
+    return response
+
+@api_router.get("/branches/changes")
+async def get_branch_changes(since: int = Query(..., ge=0)):
+    """Branches written and deleted since a snapshot or earlier changes call
+    
+    `upserts` uses the snapshot's `columns`; `deletes` lists removed ids.
+    Pass the returned `version` as `since` next time. Writes still in
+    flight when a version is read carry later versions, so they are sent
+    by the next call; rows may be sent more than once.
+    """
+    version = await get_data_version(db)
+    if since > version:
+        raise HTTPException(status_code=409, detail="Unknown data version, download a new snapshot")
+    
+    docs = await db.branches.find({"updated_version": {"$gt": since}}, SNAPSHOT_PROJECTION).to_list(length=None)
+    deletes = [t["_id"] async for t in db.branch_tombstones.find({"deleted_version": {"$gt": since}}, {"_id": 1})]
+    return Response(content=orjson.dumps({
+        "since": since,
+        "version": version,
+        "columns": SNAPSHOT_COLUMNS,
+        "upserts": [snapshot_row(b) for b in docs],
+        "deletes": deletes
+    }), media_type="application/json")
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_PROJECTION = {**BRANCH_LIST_PROJECTION, "working_hours": 1, "source_url": 1}
+EXPORT_CSV_COLUMNS = (
+    "id", "Sube_Adi", "Sirket_Adi", "Sehir", "Ilce", "Adres", "Telefon_1",
+    "google_maps_url", "logo_url", "source_url", "created_at"
+)
+
+async def export_docs_by_id(ids: list):
+    """Full documents for ids, fetched in batches and kept in the given order"""
+    for i in range(0, len(ids), EXPORT_BATCH_SIZE):
+        chunk = ids[i:i + EXPORT_BATCH_SIZE]
+        docs = await db.branches.find({"_id": {"$in": chunk}}, EXPORT_PROJECTION).to_list(length=None)
+        by_id = {doc["_id"]: doc for doc in docs}
+        for doc_id in chunk:
+            if doc_id in by_id:
+                yield by_id[doc_id]
+
+async def export_chunks(docs, fmt: str):
+    """Encode branches one batch at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        # BOM so spreadsheet apps read the Turkish characters as UTF-8
+        yield ("\ufeff" + ",".join(EXPORT_CSV_COLUMNS) + "\r\n").encode()
+    
+    rows = []
+    async for doc in docs:
+        rows.append(branch_list_row(doc))
+        if len(rows) < EXPORT_BATCH_SIZE:
+            continue
+        yield encode_export_rows(rows, fmt, buffer, writer)
+        rows = []
+    if rows:
+        yield encode_export_rows(rows, fmt, buffer, writer)
+
+def encode_export_rows(rows: list, fmt: str, buffer: io.StringIO, writer) -> bytes:
+    if fmt == "ndjson":
+        return b"".join(orjson.dumps(row) + b"\n" for row in rows)
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        row["created_at"] = row["created_at"].isoformat()
+        writer.writerow([row[column] for column in EXPORT_CSV_COLUMNS])
+    return buffer.getvalue().encode()
+
+async def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@api_router.get("/branches/export")
+async def export_branches(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    search: Optional[str] = None,
+    city: Optional[str] = None,
+    company: Optional[str] = None,
+    gzip: bool = False
+):
+    """Download all branches matching the filters as NDJSON or CSV
+    
+    Takes the same search/city/company filters as /api/branches, matches
+    them the same way and orders by name, so an export holds exactly the
+    rows the list pages through. Matching ids come from the branch index
+    (MongoDB only while it is being built); the documents are read in
+    batches and streamed as they are encoded. With `gzip=true` the download
+    is a .gz file.
+    """
+    if branch_index is not None:
+        words = search.strip().split() if search else []
+        ids = [doc["_id"] for doc in branch_index.matching(words, city=city, company=company)]
+        docs = export_docs_by_id(ids)
+    else:
+        docs = db.branches.find(build_branch_query(search, city, company), EXPORT_PROJECTION)
+        docs = docs.sort([("search.name", 1), ("_id", 1)]).batch_size(EXPORT_BATCH_SIZE)
+    
+    chunks = export_chunks(docs, format)
+    filename = f"branches.{format}"
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv; charset=utf-8"
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
 
+@api_router.get("/branches/suggest")
+async def suggest_branches(
+    q: str = Query(..., max_length=100),
+    limit: int = Query(8, ge=1, le=20)
+):
+    """Typeahead completions for the search box
+    
+    Matches companies, cities, districts and branch names that start with
+    what was typed, or have a word that does, after Turkish folding. Served
+    from the in-memory suggestion index; empty until it has been built.
+    """
+    suggestions = suggest_index.suggest(q, limit) if suggest_index is not None else []
+    return Response(content=orjson.dumps({"query": q, "suggestions": suggestions}), media_type="application/json")
+
+@api_router.get("/branches/nearby")
+async def nearby_branches(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    company: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50)
+):
+    """Closest branches to a point, optionally for one company
+    
+    Each row carries `distance_km` and `location_source`: "maps_url" for
+    exact coordinates, "district" or "city" for offline centroids, whose
+    distances are approximate. Answered from the in-memory grid, or with a
+    $nearSphere query while it is being built.
+    """
+    if geo_index is not None:
+        nearest = geo_index.nearest(lat, lon, limit, company)
+    else:
+        query = build_branch_query(None, None, company)
+        query["location"] = {"$nearSphere": {"$geometry": {"type": "Point", "coordinates": [lon, lat]}}}
+        docs = await db.branches.find(query, BRANCH_LIST_PROJECTION).limit(limit).to_list(length=limit)
+        nearest = [
+            (haversine_km(lat, lon, doc["location"]["coordinates"][1], doc["location"]["coordinates"][0]), doc)
+            for doc in docs
+        ]
+    
+    branches = []
+    for distance, doc in nearest:
+        doc_lon, doc_lat = doc["location"]["coordinates"]
+        branches.append({
+            **branch_list_row(doc),
+            "latitude": doc_lat,
+            "longitude": doc_lon,
+            "location_source": doc.get("location_source"),
+            "distance_km": round(distance, 2)
+        })
+    return Response(content=orjson.dumps({"branches": branches, "lat": lat, "lon": lon}), media_type="application/json")
+
+MAX_PHONE_MATCHES = 50
+
+@api_router.get("/branches/by-phone")
+async def get_branches_by_phone(number: str = Query(..., min_length=1, max_length=40)):
+    """Branches listing a phone number, however it is written
+    
+    The number is normalized to E.164 ("0216 345 67 89", "+90 216 3456789"
+    and "2163456789" are the same) and looked up exactly on the indexed
+    `phones` field.
+    """
+    normalized = normalize_phone(number)
+    if not normalized:
+        raise HTTPException(status_code=400, detail="Not a Turkish phone number")
+    
+    docs = await db.branches.find({"phones": normalized}, BRANCH_LIST_PROJECTION).to_list(length=MAX_PHONE_MATCHES)
+    docs.sort(key=sort_key)
+    branches = [branch_list_row(b) for b in docs]
+    return Response(content=orjson.dumps({"number": normalized, "branches": branches}), media_type="application/json")
+
+def branch_id_query(branch_id: str) -> dict:
+    """Match a branch by its ObjectId or UUID ``id``, or one merged into it by dedup.py"""
+    if ObjectId.is_valid(branch_id):
+        own = {"_id": ObjectId(branch_id)}
+    else:
+        own = {"id": branch_id}
+    return {"$or": [own, {"merged_ids": branch_id}]}
+
 @api_router.get("/branches/{branch_id}")
 async def get_branch(branch_id: str):
     """Get a specific branch by ID"""
-    from bson import ObjectId
-    
-    try:
-        branch = await db.branches.find_one({"_id": ObjectId(branch_id)})
-    except:
-        branch = await db.branches.find_one({"id": branch_id})
+    branch = await db.branches.find_one(branch_id_query(branch_id))
     
     if not branch:
         raise HTTPException(status_code=404, detail="Branch not found")
     
     return Branch(**{**branch, "id": str(branch.get("_id", branch.get("id")))})
 
+@api_router.post("/branches/bulk")
+async def bulk_upsert_branches(request: Request):
+    """Upsert branches from an NDJSON body, one BranchCreate record per line
+    
+    The body is read as it arrives; each line is validated on its own and
+    valid rows are written in unordered bulk upserts of 1000, one batch in
+    flight while the next is parsed. Rows with a source_url are matched on
+    it, others on company, city, district and name. Invalid lines are
+    skipped and reported with their line numbers.
+    """
+    batches = []
+    errors = []
+    counts = {"rows": 0, "invalid": 0, "upserted": 0, "modified": 0, "matched": 0}
+    pending = None
+    
+    async def write(number: int, rows: list) -> dict:
+        async with write_version(db) as version:
+            result = await db.branches.bulk_write([branch_bulk_upsert(row, version) for row in rows], ordered=False)
+        return {
+            "batch": number,
+            "rows": len(rows),
+            "upserted": result.upserted_count,
+            "modified": result.modified_count,
+            "matched": result.matched_count
+        }
+    
+    async def finish(task):
+        stats = await task
+        batches.append(stats)
+        for key in ("upserted", "modified", "matched"):
+            counts[key] += stats[key]
+    
+    rows = []
+    started = 0
+    line_number = 0
+    buffer = b""
+    
+    def parse(line: bytes):
+        if not line.strip():
+            return
+        try:
+            branch = BranchCreate.model_validate_json(line)
+        except ValidationError as e:
+            counts["invalid"] += 1
+            if len(errors) < MAX_BULK_ERRORS:
+                error = e.errors(include_url=False)[0]
+                field = ".".join(str(loc) for loc in error["loc"])
+                errors.append({"line": line_number, "error": f"{field}: {error['msg']}" if field else error["msg"]})
+            return
+        counts["rows"] += 1
+        rows.append(branch.model_dump())
+    
+    async def flush():
+        nonlocal pending, rows, started
+        if pending is not None:
+            await finish(pending)
+        pending = asyncio.create_task(write(len(batches) + 1, rows))
+        started += 1
+        rows = []
+    
+    try:
+        async for chunk in request.stream():
+            lines = (buffer + chunk).split(b"\n")
+            buffer = lines.pop()
+            if len(buffer) > MAX_BULK_LINE_BYTES:
+                raise HTTPException(status_code=413, detail=f"Line {line_number + 1} is longer than {MAX_BULK_LINE_BYTES} bytes")
+            for line in lines:
+                line_number += 1
+                parse(line)
+                if len(rows) >= BULK_BATCH_SIZE:
+                    await flush()
+        line_number += 1
+        parse(buffer)
+        if rows:
+            await flush()
+        if pending is not None:
+            await finish(pending)
+            pending = None
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        # A batch that failed or was cancelled may follow batches already
+        # written, and may have written part of its own rows
+        if counts["upserted"] or counts["modified"] or started > len(batches):
+            await branches_changed()
+    
+    return Response(content=orjson.dumps({**counts, "batches": batches, "errors": errors}),
+                    media_type="application/json")
+
+@api_router.post("/branches/batch")
+async def get_branches_batch(request: BranchBatchRequest):
+    """Get many branches by ID in one query, in the order requested
+    
+    Accepts ObjectId and UUID ids mixed; unknown ids are listed under
+    `missing`. Ids of branches merged away by dedup.py return the branch
+    they were merged into. Up to 500 ids per call.
+    """
+    ids = list(dict.fromkeys(request.ids))
+    object_ids = [ObjectId(i) for i in ids if ObjectId.is_valid(i)]
+    uuids = [i for i in ids if not ObjectId.is_valid(i)]
+    
+    clauses = []
+    if object_ids:
+        clauses.append({"_id": {"$in": object_ids}})
+    if uuids:
+        clauses.append({"id": {"$in": uuids}})
+    clauses.append({"merged_ids": {"$in": ids}})
+    docs = await db.branches.find({"$or": clauses}, {"search": 0}).to_list(length=None)
+    
+    found = {}
+    for doc in docs:
+        found[str(doc["_id"])] = doc
+        if doc.get("id"):
+            found[doc["id"]] = doc
+    for doc in docs:
+        for merged_id in doc.get("merged_ids", ()):
+            found.setdefault(merged_id, doc)
+    
+    branches = [branch_list_row(found[i]) for i in ids if i in found]
+    missing = [i for i in ids if i not in found]
+    return Response(content=orjson.dumps({"branches": branches, "missing": missing}), media_type="application/json")
+
+async def distinct_branch_values(field: str) -> list:
+    """Sorted non-empty values of a branch field, from the index when built"""
+    if branch_index is not None:
+        return branch_index.distinct(field)
+    values = await db.branches.distinct(field)
+    return sorted([v for v in values if v])
+
+def cached_json(request: Request, payload, etag: str) -> Response:
+    """Send payload with its ETag, or 304 if the client already has it"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
+
 @api_router.get("/companies")
-async def get_companies():
+async def get_companies(request: Request):
     """Get list of all cargo companies"""
-    companies = await db.branches.distinct("company")
-    return {"companies": sorted([c for c in companies if c])}
+    async def compute():
+        return {"companies": await distinct_branch_values("company")}
+    
+    payload, etag = await listing_cache.get("companies", branch_index_version, compute)
+    return cached_json(request, payload, etag)
 
 @api_router.get("/cities")
-async def get_cities():
+async def get_cities(request: Request):
     """Get list of all cities with branches"""
-    cities = await db.branches.distinct("city")
-    return {"cities": sorted([c for c in cities if c])}
+    async def compute():
+        return {"cities": await distinct_branch_values("city")}
+    
+    payload, etag = await listing_cache.get("cities", branch_index_version, compute)
+    return cached_json(request, payload, etag)
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    """Hit/miss/eviction counters for the branch search cache"""
+    return {"search": search_cache.stats(), "data_version": branch_index_version}
 
 # ---- Help Topics Routes ----
 
+def static_response(request: Request, payload: StaticPayload, cache_control: str = "public, max-age=3600") -> Response:
+    """Serve a pre-compressed payload, or 304 if the client already has it"""
+    encoding, body, etag = payload.select(request.headers.get("accept-encoding"))
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if payload.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @api_router.get("/help-topics")
-async def get_help_topics():
+async def get_help_topics(request: Request):
     """Get all help topics"""
-    # Check if topics exist in DB, if not seed them
-    count = await db.help_topics.count_documents({})
-    if count == 0:
-        # Seed help topics
-        for topic in HELP_TOPICS_DATA:
-            await db.help_topics.update_one(
-                {"id": topic["id"]},
-                {"$set": topic},
-                upsert=True
-            )
-    
-    topics = await db.help_topics.find().sort("order", 1).to_list(100)
-    return {
-        "topics": [
-            {
-                "id": t["id"],
-                "title": t["title"],
-                "short_description": t["short_description"],
-                "icon": t.get("icon", "help-circle")
-            }
-            for t in topics
-        ]
-    }
+    return static_response(request, HELP_TOPICS_LIST)
 
 @api_router.get("/help-topics/{topic_id}")
-async def get_help_topic(topic_id: str):
+async def get_help_topic(topic_id: str, request: Request):
     """Get a specific help topic by ID"""
-    topic = await db.help_topics.find_one({"id": topic_id})
-    
-    if not topic:
-        # Try to find from static data
-        for t in HELP_TOPICS_DATA:
-            if t["id"] == topic_id:
-                return t
+    topic = HELP_TOPICS_BY_ID.get(topic_id)
+    if topic is None:
         raise HTTPException(status_code=404, detail="Help topic not found")
     
-    return {
-        "id": topic["id"],
-        "title": topic["title"],
-        "short_description": topic["short_description"],
-        "content": topic["content"],
-        "icon": topic.get("icon", "help-circle")
-    }
+    return static_response(request, topic)
 
 # ---- Scraper Routes ----
 
 @api_router.post("/scrape/branches")
-async def scrape_branches(sitemap_index: int = Query(1, ge=1, le=7)):
+async def scrape_branches(sitemap_index: int = Query(1, ge=1, le=SITEMAP_COUNT)):
     """Scrape branches from kargolojik.com sitemaps"""
-    sitemap_url = f"https://kargolojik.com/post-sitemap{sitemap_index}.xml"
+    url = sitemap_url(CRAWL_BASE_URL, sitemap_index)
     
     try:
         async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.get(sitemap_url)
+            response = await client.get(url)
             response.raise_for_status()
             
-            # Parse XML
-            root = ET.fromstring(response.text)
-            
-            # Extract URLs from sitemap
-            urls = []
-            for url_elem in root.iter():
-                if url_elem.tag.endswith('loc'):
-                    url = url_elem.text
-                    # Filter only branch URLs (containing 'subesi' or 'sube')
-                    if url and 'subesi' in url.lower():
-                        urls.append(url)
+            urls = [loc for loc, _ in parse_sitemap(response.text)]
             
             return {
                 "message": f"Found {len(urls)} branch URLs in sitemap {sitemap_index}",
-                "sitemap_url": sitemap_url,
+                "sitemap_url": url,
                 "url_count": len(urls),
                 "sample_urls": urls[:10]
             }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to scrape sitemap: {str(e)}")
 
-@api_router.post("/scrape/branch-detail")
-async def scrape_branch_detail(url: str):
-    """Scrape detailed branch information from a specific URL"""
+class ScrapeJobRequest(BaseModel):
+    sitemap_index: Optional[int] = Field(None, ge=1, le=SITEMAP_COUNT)
+    max_urls: Optional[int] = Field(None, ge=1)
+    concurrency: int = Field(16, ge=1, le=64)
+    full: bool = False
+    reparse: bool = False
+    urls: Optional[List[str]] = Field(None, max_length=MAX_JOB_URLS)
+
+async def enqueue_crawl(job: ScrapeJobRequest) -> Response:
+    params = {
+        "sitemap_indexes": [job.sitemap_index] if job.sitemap_index else None,
+        "max_urls": job.max_urls,
+        "concurrency": job.concurrency,
+        "full": job.full,
+        "reparse": job.reparse,
+        "urls": job.urls or None
+    }
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Extract branch name from h1
-            name = ""
-            h1 = soup.find('h1')
-            if h1:
-                name = h1.get_text(strip=True)
-            
-            # Determine company from name
-            company = ""
-            company_keywords = ['PTT', 'Yurtiçi', 'Aras', 'MNG', 'Sürat', 'UPS', 'DHL', 'FedEx', 'TNT', 'Inter Global']
-            name_lower = name.lower()
-            for kw in company_keywords:
-                if kw.lower() in name_lower:
-                    company = kw
-                    break
-            
-            # Extract location
-            city = ""
-            district = ""
-            location_match = re.search(r'📍.*?Konum:?\s*([^/]+)/\s*(.+)', response.text)
-            if location_match:
-                city = location_match.group(1).strip()
-                district = location_match.group(2).strip()
-            
-            # Extract address
-            address = ""
-            address_match = re.search(r'🏠.*?Adres:?\s*(.+?)(?=📞|<)', response.text, re.DOTALL)
-            if address_match:
-                address = address_match.group(1).strip()
-                address = re.sub(r'<[^>]+>', '', address).strip()
-            
-            # Extract phone
-            phone = ""
-            phone_match = re.search(r'📞.*?Telefon:?\s*([0-9\s\-/]+)', response.text)
-            if phone_match:
-                phone = phone_match.group(1).strip()
-            
-            # Extract Google Maps URL
-            google_maps_url = ""
-            maps_link = soup.find('a', href=lambda h: h and 'google.com/maps' in h)
-            if maps_link:
-                google_maps_url = maps_link['href']
-            
-            # Extract logo URL
-            logo_url = ""
-            logo_img = soup.find('img', src=lambda s: s and 'logo' in s.lower())
-            if logo_img:
-                logo_url = logo_img['src']
-            
-            branch_data = {
-                "name": name,
-                "company": company,
-                "city": city,
-                "district": district,
-                "address": address,
-                "phone": phone,
-                "google_maps_url": google_maps_url,
-                "logo_url": logo_url,
-                "source_url": url
-            }
-            
-            # Save to database
-            result = await db.branches.update_one(
-                {"source_url": url},
-                {"$set": {**branch_data, "id": str(uuid.uuid4())}},
-                upsert=True
-            )
-            
-            return {
-                "message": "Branch scraped successfully",
-                "branch": branch_data,
-                "upserted": result.upserted_id is not None
-            }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to scrape branch: {str(e)}")
+        doc = await scrape_jobs.submit(params)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return Response(content=orjson.dumps(job_view(doc)), status_code=202, media_type="application/json",
+                    headers={"Location": f"/api/scrape/jobs/{doc['_id']}"})
+
+@api_router.post("/scrape/jobs", status_code=202)
+async def create_scrape_job(job: ScrapeJobRequest):
+    """Queue a crawl of the sitemaps, one sitemap or a list of branch page URLs
+    
+    Returns at once with the job; poll GET /api/scrape/jobs/{id} for its
+    progress. Unless `full` is set, pages whose sitemap lastmod, ETag or
+    content hash show no change since the last crawl are not re-parsed.
+    With `reparse`, nothing is fetched: the pages kept from earlier crawls
+    (all of them, or just `urls`) are extracted again and upserted.
+    """
+    return await enqueue_crawl(job)
+
+@api_router.get("/scrape/jobs")
+async def list_scrape_jobs(limit: int = Query(20, ge=1, le=100)):
+    """Most recent scrape jobs, newest first"""
+    return {"jobs": [job_view(doc) for doc in await scrape_jobs.recent(limit)]}
+
+@api_router.get("/scrape/jobs/{job_id}")
+async def get_scrape_job(job_id: str):
+    """Status, progress, throughput and error of one scrape job"""
+    doc = await scrape_jobs.get(job_id)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Scrape job not found")
+    return job_view(doc)
+
+@api_router.post("/scrape/crawl", status_code=202)
+async def crawl_branches(
+    sitemap_index: Optional[int] = Query(None, ge=1, le=SITEMAP_COUNT),
+    max_urls: Optional[int] = Query(None, ge=1),
+    concurrency: int = Query(16, ge=1, le=64),
+    full: bool = False
+):
+    """Queue a crawl of every branch page in the sitemaps (or just one sitemap)
+    
+    Same as POST /api/scrape/jobs with query parameters.
+    """
+    return await enqueue_crawl(ScrapeJobRequest(
+        sitemap_index=sitemap_index, max_urls=max_urls, concurrency=concurrency, full=full
+    ))
+
+@api_router.post("/scrape/branch-detail", status_code=202)
+async def scrape_branch_detail(url: str):
+    """Queue a scrape of one branch page
+    
+    The page is always fetched again, then stored and upserted by a job
+    like any crawl; poll GET /api/scrape/jobs/{id} for the result.
+    """
+    return await enqueue_crawl(ScrapeJobRequest(urls=[url], concurrency=1, full=True))
 
 @api_router.post("/seed/sample-branches")
 async def seed_sample_branches():
@@ -713,15 +1343,19 @@ async def seed_sample_branches():
         }
     ]
     
-    inserted_count = 0
     for branch in sample_branches:
-        result = await db.branches.update_one(
-            {"name": branch["name"]},
-            {"$set": branch},
-            upsert=True
+        branch["search"] = search_keys(branch)
+        branch.update(location_fields(branch))
+        branch.update(phone_fields(branch))
+        branch["origin"] = "seed"
+    async with write_version(db) as version:
+        result = await db.branches.bulk_write(
+            [UpdateOne({"name": branch["name"]}, {"$set": {**branch, "updated_version": version}}, upsert=True)
+             for branch in sample_branches],
+            ordered=False
         )
-        if result.upserted_id:
-            inserted_count += 1
+    inserted_count = result.upserted_count
+    await branches_changed()
     
     return {
         "message": f"Seeded {inserted_count} new branches, {len(sample_branches) - inserted_count} already existed",
@@ -729,19 +1363,22 @@ async def seed_sample_branches():
     }
 
 @api_router.get("/stats")
-async def get_stats():
+async def get_stats(request: Request):
     """Get database statistics"""
-    branch_count = await db.branches.count_documents({})
-    topic_count = await db.help_topics.count_documents({})
-    companies = await db.branches.distinct("company")
-    cities = await db.branches.distinct("city")
+    async def compute():
+        if branch_index is not None:
+            branch_count = len(branch_index)
+        else:
+            branch_count = await db.branches.count_documents({})
+        return {
+            "branches": branch_count,
+            "help_topics": len(HELP_TOPICS_BY_ID),
+            "companies": len(await distinct_branch_values("company")),
+            "cities": len(await distinct_branch_values("city"))
+        }
     
-    return {
-        "branches": branch_count,
-        "help_topics": topic_count if topic_count > 0 else len(HELP_TOPICS_DATA),
-        "companies": len([c for c in companies if c]),
-        "cities": len([c for c in cities if c])
-    }
+    payload, etag = await listing_cache.get("stats", branch_index_version, compute)
+    return cached_json(request, payload, etag)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -761,6 +1398,40 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def init_search():
+    global index_refresh_task
+    try:
+        await seed_help_topics()
+    except Exception as e:
+        logger.error(f"Seeding help topics failed: {e}")
+    try:
+        await ensure_indexes(db)
+        backfilled = await backfill_search_keys(db)
+        if backfilled:
+            logger.info(f"Added search keys to {backfilled} branches")
+        located = await backfill_locations(db)
+        if located:
+            logger.info(f"Added locations to {located} branches")
+        normalized = await backfill_phones(db)
+        if normalized:
+            logger.info(f"Added normalized phone numbers to {normalized} branches")
+    except Exception as e:
+        logger.error(f"Creating branch indexes failed: {e}")
+    try:
+        await refresh_branch_index(force=True)
+    except Exception as e:
+        logger.error(f"Initial branch index build failed, falling back to MongoDB search: {e}")
+    index_refresh_task = asyncio.create_task(index_refresh_loop())
+    try:
+        await scrape_jobs.start()
+    except Exception as e:
+        logger.error(f"Starting scrape job workers failed: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if index_refresh_task:
+        index_refresh_task.cancel()
+    await scrape_jobs.stop()
+    extractor_pool.shutdown()
     client.close()
@@ -0,0 +1,182 @@
+"""
+In-memory prefix index for search-box suggestions.
+
+Built from the same documents as the branch index. Every distinct company,
+city, district and branch name becomes one suggestion, reachable from the
+start of its folded text and from the start of each later word, so "kad"
+completes both "Kadıköy" and "PTT Kargo Kadıköy Şubesi". Keys live in one
+sorted list and a prefix lookup is a bisect; the best suggestions for
+prefixes matching many keys are precomputed at build time, so a lookup only
+ever ranks a few hundred keys.
+
+Ranking: matches at the start of a suggestion before matches at a later
+word, then companies, cities, districts and branches, then by how many
+branches a suggestion covers.
+"""
+
+from bisect import bisect_left
+
+from search_keys import normalize_text
+
+KIND_ORDER = ('company', 'city', 'district', 'branch')
+MAX_SUGGESTIONS = 20
+SCAN_LIMIT = 256            # larger prefix ranges are precomputed
+FILTER_SCAN_LIMIT = 4096    # keys examined for out-of-order multi-word queries
+PREFIX_END = '\uffff'
+
+
+class SuggestIndex:
+    """Sorted prefix keys over folded suggestion texts"""
+
+    def __init__(self, docs=()):
+        self._entries = []      # entry id -> suggestion payload
+        self._texts = []        # entry id -> folded text
+        self._keys = []         # sorted prefix keys
+        self._ranks = []        # key position -> rank (lower is better)
+        self._rank_entry = []   # rank -> entry id
+        self._top = {}          # prefix -> best entry ids, for large ranges
+        self._build(docs)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _build(self, docs):
+        groups = {}  # (kind, folded text, scope) -> [payload, count]
+        folded_values = {}
+
+        def fold(text):
+            folded = folded_values.get(text)
+            if folded is None:
+                folded = folded_values[text] = normalize_text(text)
+            return folded
+
+        def add(kind, text, scope='', **extra):
+            folded = fold(text)
+            if not folded:
+                return
+            group = groups.get((kind, folded, scope))
+            if group is None:
+                groups[(kind, folded, scope)] = [{"type": kind, "text": text.strip(), **extra}, 1]
+            else:
+                group[1] += 1
+
+        for doc in docs:
+            if doc is None:
+                continue
+            city = doc.get('city') or ''
+            add('company', doc.get('company') or '')
+            add('city', city)
+            add('district', doc.get('district') or '', fold(city), city=city.strip())
+            add('branch', doc.get('name') or '', str(doc.get('_id', doc.get('id'))),
+                id=str(doc.get('_id', doc.get('id'))), city=city.strip())
+
+        raw = []  # (key, rank tuple, entry id)
+        for (kind, folded, _), (payload, count) in groups.items():
+            entry_id = len(self._entries)
+            payload["count"] = count
+            self._entries.append(payload)
+            self._texts.append(folded)
+            kind_order = KIND_ORDER.index(kind)
+            words = folded.split(' ')
+            for i in range(len(words)):
+                raw.append((' '.join(words[i:]), (i > 0, kind_order, -count, folded), entry_id))
+
+        by_rank = sorted(range(len(raw)), key=lambda i: raw[i][1])
+        rank_of = [0] * len(raw)
+        for rank, i in enumerate(by_rank):
+            rank_of[i] = rank
+        self._rank_entry = [raw[i][2] for i in by_rank]
+        pairs = sorted((raw[i][0], rank_of[i]) for i in range(len(raw)))
+        self._keys = [key for key, _ in pairs]
+        self._ranks = [rank for _, rank in pairs]
+        self._precompute()
+
+    def _precompute(self):
+        """Store the best suggestions of every prefix with a large key range"""
+        keys = self._keys
+        stack = [('', 0, len(keys))]
+        while stack:
+            prefix, lo, hi = stack.pop()
+            if hi - lo <= SCAN_LIMIT:
+                continue
+            if prefix:
+                self._top[prefix] = []
+            depth = len(prefix)
+            i = lo
+            while i < hi:
+                if len(keys[i]) <= depth:
+                    i += 1
+                    continue
+                child = keys[i][:depth + 1]
+                j = bisect_left(keys, child + PREFIX_END, i, hi)
+                stack.append((child, i, j))
+                i = j
+
+        # One pass in rank order fills every list best-first
+        open_lists = len(self._top)
+        key_at_rank = [None] * len(keys)
+        for pos, rank in enumerate(self._ranks):
+            key_at_rank[rank] = keys[pos]
+        for rank, key in enumerate(key_at_rank):
+            if not open_lists:
+                break
+            entry_id = self._rank_entry[rank]
+            for size in range(1, len(key) + 1):
+                top = self._top.get(key[:size])
+                if top is None:
+                    break
+                if len(top) < MAX_SUGGESTIONS and entry_id not in top:
+                    top.append(entry_id)
+                    if len(top) == MAX_SUGGESTIONS:
+                        open_lists -= 1
+
+    def _range(self, prefix: str):
+        lo = bisect_left(self._keys, prefix)
+        return lo, bisect_left(self._keys, prefix + PREFIX_END, lo)
+
+    def _rank_range(self, lo: int, hi: int, limit: int, accept=None) -> list:
+        """Best distinct entry ids among the keys in [lo, hi)"""
+        result = []
+        seen = set()
+        for rank in sorted(self._ranks[lo:hi]):
+            entry_id = self._rank_entry[rank]
+            if entry_id in seen or (accept is not None and not accept(entry_id)):
+                continue
+            seen.add(entry_id)
+            result.append(entry_id)
+            if len(result) == limit:
+                break
+        return result
+
+    def _phrase(self, prefix: str, limit: int) -> list:
+        lo, hi = self._range(prefix)
+        if hi - lo > SCAN_LIMIT:
+            return self._top[prefix][:limit]
+        return self._rank_range(lo, hi, limit)
+
+    def _words(self, words: list, limit: int, exclude: set) -> list:
+        """Entries containing every word as a word prefix, in any order"""
+        ranges = sorted((self._range(w) for w in words), key=lambda r: r[1] - r[0])
+        lo, hi = ranges[0]
+        if hi - lo > FILTER_SCAN_LIMIT:
+            return []
+
+        def accept(entry_id):
+            if entry_id in exclude:
+                return False
+            text = ' ' + self._texts[entry_id]
+            return all(' ' + w in text for w in words)
+
+        return self._rank_range(lo, hi, limit, accept)
+
+    def suggest(self, query: str, limit: int = 8) -> list:
+        """Top completions for what the user has typed so far"""
+        query = normalize_text(query)
+        if not query:
+            return []
+        limit = min(limit, MAX_SUGGESTIONS)
+        ids = self._phrase(query, limit)
+        words = query.split(' ')
+        if len(ids) < limit and len(words) > 1:
+            ids += self._words(words, limit - len(ids), set(ids))
+        return [self._entries[i] for i in ids]
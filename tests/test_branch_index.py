@@ -0,0 +1,173 @@
+import random
+from collections import Counter
+
+import pytest
+
+from branch_index import BranchIndex, SEARCH_FIELDS, edit_distance, max_edits, sort_key
+from search_keys import normalize_text, tokenize
+
+WORDS = ['Kadıköy', 'Moda', 'Beşiktaş', 'Çarşı', 'Şişli', 'Merkez', 'Yeni', 'Bağcılar', 'Üsküdar',
+         'İstasyon', 'Cad.', 'Sok.', 'Mah.', 'No:12', 'Gül', 'Atatürk', 'Kızılay', 'Bornova']
+CITIES = ['İstanbul', 'Ankara', 'İzmir', 'Bursa', 'Adana', '']
+COMPANIES = ['PTT Kargo', 'Aras Kargo', 'Yurtiçi Kargo', 'MNG Kargo', 'Sürat', '']
+
+
+def make_docs(n: int, seed: int) -> list:
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n):
+        docs.append({
+            '_id': f'{i:05d}',
+            'name': ' '.join(rng.sample(WORDS, rng.randint(1, 3))),
+            'address': ' '.join(rng.sample(WORDS, rng.randint(0, 4))),
+            'city': rng.choice(CITIES),
+            'district': rng.choice(WORDS),
+            'company': rng.choice(COMPANIES),
+        })
+    return docs
+
+
+def brute_matches(docs: list, words: list, city=None, company=None) -> list:
+    words = [normalize_text(w) for w in words if w]
+    city, company = normalize_text(city), normalize_text(company)
+    found = []
+    for doc in docs:
+        fields = [normalize_text(doc.get(f)) for f in SEARCH_FIELDS]
+        if city not in normalize_text(doc.get('city')) or company not in normalize_text(doc.get('company')):
+            continue
+        if all(any(w in f for f in fields) for w in words):
+            found.append(doc)
+    return sorted(found, key=sort_key)
+
+
+def random_query(rng: random.Random) -> tuple:
+    words = [rng.choice(WORDS)[rng.randint(0, 2):][:rng.randint(1, 6)] for _ in range(rng.randint(0, 2))]
+    city = rng.choice([None, None, rng.choice(CITIES)[1:4]])
+    company = rng.choice([None, None, rng.choice(COMPANIES)[:3]])
+    return words, city, company
+
+
+@pytest.fixture(scope='module')
+def corpus():
+    docs = make_docs(600, seed=4)
+    return docs, BranchIndex(docs)
+
+
+def test_search_count_and_matching_agree_with_brute_force(corpus):
+    docs, index = corpus
+    rng = random.Random(5)
+    for _ in range(300):
+        words, city, company = random_query(rng)
+        expected = [d['_id'] for d in brute_matches(docs, words, city, company)]
+        page, _ = index.search(words, city, company, limit=len(docs))
+        assert [d['_id'] for d in page] == expected, (words, city, company)
+        assert index.count(words, city, company) == len(expected)
+        assert [d['_id'] for d in index.matching(words, city, company)] == expected
+
+
+def test_cursor_and_skip_pages_cover_every_match_once(corpus):
+    docs, index = corpus
+    rng = random.Random(6)
+    for _ in range(50):
+        words, city, company = random_query(rng)
+        expected = [d['_id'] for d in brute_matches(docs, words, city, company)]
+        limit = rng.randint(1, 25)
+        seen, after = [], None
+        while True:
+            page, after = index.search(words, city, company, limit=limit, after=after)
+            seen += [d['_id'] for d in page]
+            if after is None:
+                break
+        assert seen == expected
+        skip = rng.randint(0, len(expected))
+        page, _ = index.search(words, city, company, skip=skip, limit=limit)
+        assert [d['_id'] for d in page] == expected[skip:skip + limit]
+
+
+def test_upsert_replaces_the_indexed_copy():
+    docs = make_docs(50, seed=7)
+    index = BranchIndex(docs)
+    changed = dict(docs[0], name='Zzyzx Şube')
+    index.upsert(changed)
+    docs[0] = changed
+    assert len(index) == 50
+    for words in (['zzyzx'], [docs[1]['name'].split()[0]], []):
+        expected = [d['_id'] for d in brute_matches(docs, words)]
+        assert [d['_id'] for d in index.matching(words)] == expected
+
+
+def test_facets_count_every_match(corpus):
+    docs, index = corpus
+    rng = random.Random(8)
+    for _ in range(30):
+        words, city, company = random_query(rng)
+        matches = brute_matches(docs, words, city, company)
+        facets = index.facets(words, city, company)
+        companies = Counter(d['company'] for d in matches if d['company'])
+        assert {f['value']: f['count'] for f in facets['company']} == companies
+        cities = Counter(d['city'] for d in matches if d['city'])
+        assert {f['value']: f['count'] for f in facets['city']} == cities
+
+
+def osa_distance(a: str, b: str) -> int:
+    """Unbounded edit distance with adjacent swaps, by the textbook table"""
+    d = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(len(a) + 1):
+        d[i][0] = i
+    for j in range(len(b) + 1):
+        d[0][j] = j
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[-1][-1]
+
+
+def test_edit_distance_is_capped_osa_distance():
+    rng = random.Random(9)
+    for _ in range(3000):
+        a = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 7)))
+        b = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 7)))
+        bound = rng.randint(0, 3)
+        assert edit_distance(a, b, bound) == min(osa_distance(a, b), bound + 1), (a, b, bound)
+
+
+def token_matches(token: str, term: str) -> bool:
+    if term == token or term.startswith(token):
+        return True
+    bound = max_edits(token)
+    return bool(bound) and not term.isdigit() and osa_distance(token, term) <= bound
+
+
+def test_ranked_matches_every_token_exactly_by_prefix_or_within_typos(corpus):
+    docs, index = corpus
+    rng = random.Random(10)
+
+    def typo(word):
+        """The word with one deletion, substitution, insertion or swap, or as is"""
+        if len(word) < 5 or rng.random() < 0.3:
+            return word
+        i = rng.randrange(1, len(word) - 1)
+        return rng.choice([
+            word[:i] + word[i + 1:],
+            word[:i] + 'x' + word[i + 1:],
+            word[:i] + 'e' + word[i:],
+            word[:i] + word[i + 1] + word[i] + word[i + 2:],
+        ])
+
+    for _ in range(100):
+        words = [typo(normalize_text(rng.choice(WORDS))[:rng.randint(2, 9)]) for _ in range(rng.randint(1, 2))]
+        tokens = [t for w in words for t in tokenize(w)]
+        city = rng.choice([None, rng.choice(CITIES)[1:4]])
+        expected = set()
+        for doc in docs:
+            terms = {t for f in SEARCH_FIELDS for t in tokenize(doc.get(f))}
+            if city and normalize_text(city) not in normalize_text(doc['city']):
+                continue
+            if all(any(token_matches(token, t) for t in terms) for token in tokens):
+                expected.add(doc['_id'])
+        ranked, total = index.ranked(words, city, limit=len(docs))
+        assert total == len(expected), words
+        assert {d['_id'] for d in ranked} == expected, words
+        assert [d['_id'] for d in index.ranked(words, city, skip=3, limit=5)[0]] == [d['_id'] for d in ranked[3:8]]
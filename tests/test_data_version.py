@@ -0,0 +1,84 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from data_version import (VERSION_DOC_ID, delete_branches, finish_write, get_data_version, published_version,
+                          start_write, write_version)
+
+
+def writer(version: int, seconds: float) -> dict:
+    return {'version': version, 'until': datetime.utcnow() + timedelta(seconds=seconds)}
+
+
+def test_published_version_waits_for_the_oldest_live_writer():
+    assert published_version(None) == 0
+    assert published_version({'version': 5}) == 5
+    assert published_version({'version': 5, 'writing': []}) == 5
+    assert published_version({'version': 9, 'writing': [writer(9, 60), writer(7, 60)]}) == 6
+    # Writers whose lease ran out no longer hold the version back
+    assert published_version({'version': 9, 'writing': [writer(7, -1), writer(9, 60)]}) == 8
+    assert published_version({'version': 9, 'writing': [writer(7, -1)]}) == 9
+
+
+def test_published_version_matches_oracle():
+    rng = random.Random(16)
+    for _ in range(1000):
+        top = rng.randint(0, 30)
+        live = set(rng.sample(range(1, top + 1), rng.randint(0, top))) if top else set()
+        dead = set(rng.sample(range(1, top + 1), rng.randint(0, top))) - live if top else set()
+        doc = {'version': top, 'writing': [writer(v, 60) for v in live] + [writer(v, -1) for v in dead]}
+        rng.shuffle(doc['writing'])
+        # Highest version with every version at or below it finished
+        expected = max([v for v in range(top + 1) if not any(w <= v for w in live)])
+        assert published_version(doc) == expected
+
+
+@pytest.fixture
+def db():
+    mongomock_motor = pytest.importorskip('mongomock_motor')
+    return mongomock_motor.AsyncMongoMockClient()['test']
+
+
+def test_overlapping_writers_never_publish_unfinished_versions(db):
+    async def run():
+        rng = random.Random(17)
+        finished = set()
+        taken = []
+
+        async def one_writer():
+            version = await start_write(db)
+            taken.append(version)
+            await asyncio.sleep(rng.random() / 100)
+            published = await get_data_version(db)
+            assert published < version
+            assert all(v in finished for v in range(1, published + 1))
+            # Marked before the version is released, so any version a
+            # reader can see published is already in the set
+            finished.add(version)
+            await finish_write(db, version)
+
+        await asyncio.gather(*[one_writer() for _ in range(60)])
+        assert sorted(taken) == list(range(1, 61))
+        assert await get_data_version(db) == 60
+        doc = await db.meta.find_one({'_id': VERSION_DOC_ID})
+        assert doc['writing'] == []
+
+    asyncio.run(run())
+
+
+def test_delete_branches_leaves_versioned_tombstones(db):
+    async def run():
+        await db.branches.insert_many([{'_id': f'b{i}', 'city': 'Ankara' if i % 3 else 'İzmir'} for i in range(10)])
+        async with write_version(db) as version:
+            assert version == 1
+        deleted = await delete_branches(db, {'city': 'Ankara'})
+        assert deleted == 6
+        assert await db.branches.count_documents({}) == 4
+        tombstones = await db.branch_tombstones.find({}).to_list(length=None)
+        assert sorted(t['_id'] for t in tombstones) == sorted(f'b{i}' for i in range(10) if i % 3)
+        assert {t['deleted_version'] for t in tombstones} == {2}
+        assert await get_data_version(db) == 2
+
+    asyncio.run(run())
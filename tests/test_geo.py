@@ -0,0 +1,56 @@
+import random
+
+from geo import GeoGrid, haversine_km
+from search_keys import normalize_text
+
+COMPANIES = ['PTT Kargo', 'Aras Kargo', 'Yurtiçi Kargo', 'Sürat']
+
+
+def make_docs(n: int, seed: int) -> list:
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n):
+        doc = {'_id': f'{i:05d}', 'company': rng.choice(COMPANIES)}
+        if rng.random() < 0.9:
+            # Turkey, plus a few clustered points to force ties between cells
+            lat, lon = (rng.uniform(36, 42), rng.uniform(26, 45)) if i % 10 else (41.0, 29.0)
+            doc['location'] = {'type': 'Point', 'coordinates': [lon, lat]}
+        docs.append(doc)
+    return docs
+
+
+def brute_nearest(docs: list, lat: float, lon: float, k: int, company=None) -> list:
+    company = normalize_text(company)
+    found = []
+    for doc in docs:
+        if not doc.get('location') or company not in normalize_text(doc['company']):
+            continue
+        doc_lon, doc_lat = doc['location']['coordinates']
+        found.append((haversine_km(lat, lon, doc_lat, doc_lon), doc['_id']))
+    return sorted(found)[:k]
+
+
+def test_nearest_matches_brute_force():
+    docs = make_docs(2000, seed=13)
+    grid = GeoGrid(docs)
+    assert len(grid) == sum(1 for doc in docs if doc.get('location'))
+    rng = random.Random(14)
+    for _ in range(300):
+        lat, lon = rng.uniform(34, 44), rng.uniform(20, 50)
+        k = rng.randint(1, 30)
+        company = rng.choice([None, None, 'aras', 'Yurtiçi', 'nobody'])
+        got = [(distance, doc['_id']) for distance, doc in grid.nearest(lat, lon, k, company)]
+        assert got == brute_nearest(docs, lat, lon, k, company), (lat, lon, k, company)
+
+
+def test_upsert_moves_and_drops_documents():
+    docs = make_docs(200, seed=15)
+    grid = GeoGrid(docs)
+    moved = dict(docs[1], location={'type': 'Point', 'coordinates': [44.0, 39.9]})
+    dropped = {k: v for k, v in docs[2].items() if k != 'location'}
+    grid.upsert(moved)
+    grid.upsert(dropped)
+    docs[1], docs[2] = moved, dropped
+    for lat, lon in ((39.9, 44.0), (41.0, 29.0), (37.0, 35.0)):
+        got = [(distance, doc['_id']) for distance, doc in grid.nearest(lat, lon, 15)]
+        assert got == brute_nearest(docs, lat, lon, 15)
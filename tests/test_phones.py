@@ -0,0 +1,53 @@
+import random
+
+from phones import normalize_phone, phone_fields, phone_numbers
+
+
+def test_normalize_phone_formats():
+    expected = '+902163456789'
+    for number in ('0 216 345 67 89', '(0216) 3456789', '0216-345-67-89', '2163456789',
+                   '+90 216 345 67 89', '0090 216 345 6789', '90 216 345 67 89'):
+        assert normalize_phone(number) == expected, number
+    assert normalize_phone('444 0 444') == '+904440444'
+    assert normalize_phone('0532 111 22 33') == '+905321112233'
+    assert normalize_phone('0850 222 0 333') == '+908502220333'
+
+
+def test_normalize_phone_rejects_non_turkish_numbers():
+    for number in ('', None, '12345', '0116 345 67 89', '+1 212 555 0100', '0216 345 67 899', 'yok'):
+        assert normalize_phone(number) == '', number
+
+
+def format_number(rng: random.Random, digits: str) -> str:
+    """One national number written the way sheets and pages write them"""
+    area, a, b, c = digits[:3], digits[3:6], digits[6:8], digits[8:]
+    return rng.choice([
+        f'0{area} {a} {b} {c}',
+        f'(0{area}) {a}{b}{c}',
+        f'0{area}-{a}-{b}-{c}',
+        f'+90 {area} {a} {b} {c}',
+        f'0090{digits}',
+        digits,
+    ])
+
+
+def test_phone_numbers_splits_like_oracle():
+    rng = random.Random(3)
+    separators = [' / ', '/', ', ', ';', ' | ', ' veya ']
+    for _ in range(1000):
+        numbers = [rng.choice('23458') + ''.join(rng.choice('0123456789') for _ in range(9))
+                   for _ in range(rng.randint(1, 4))]
+        numbers += rng.sample(numbers, rng.randint(0, len(numbers)))     # repeats
+        text = ''
+        for i, digits in enumerate(numbers):
+            if i:
+                text += rng.choice(separators)
+            text += format_number(rng, digits)
+        expected = list(dict.fromkeys(f'+90{digits}' for digits in numbers))
+        assert phone_numbers(text) == expected, text
+
+
+def test_phone_numbers_skips_parts_that_are_not_numbers():
+    assert phone_numbers('Santral: 0216 345 67 89 / dahili 12') == ['+902163456789']
+    assert phone_numbers(None) == []
+    assert phone_fields({'phone': '444 0 444'}) == {'phones': ['+904440444']}
@@ -0,0 +1,50 @@
+import random
+import unicodedata
+
+from search_keys import normalize_text, search_keys, tokenize
+
+TURKISH_LETTERS = 'abcçdefgğhıijklmnoöprsştuüvyzABCÇDEFGĞHIİJKLMNOÖPRSŞTUÜVYZâîûÂÎÛ'
+
+
+def fold_oracle(text: str) -> str:
+    """Dotted and dotless i both become i; every other letter loses its accent"""
+    text = text.replace('ı', 'i').replace('I', 'i').replace('İ', 'i')
+    stripped = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return ' '.join(stripped.lower().split())
+
+
+def test_turkish_letters_fold_to_ascii():
+    assert normalize_text('Kadıköy') == 'kadikoy'
+    assert normalize_text('İSTANBUL') == 'istanbul'
+    assert normalize_text('ISPARTA') == 'isparta'
+    assert normalize_text('Şişli Çarşı Ğ Ü Ö') == 'sisli carsi g u o'
+    assert normalize_text('  Yurtiçi\tKargo \n') == 'yurtici kargo'
+    assert normalize_text(None) == ''
+
+
+def test_folding_matches_unicode_oracle():
+    rng = random.Random(1)
+    for _ in range(2000):
+        text = ''.join(rng.choice(TURKISH_LETTERS + '  .-/0123456789') for _ in range(rng.randint(0, 30)))
+        assert normalize_text(text) == fold_oracle(text)
+
+
+def test_folded_text_is_ascii_and_stable():
+    rng = random.Random(2)
+    for _ in range(500):
+        text = ''.join(rng.choice(TURKISH_LETTERS + ' ') for _ in range(20))
+        folded = normalize_text(text)
+        assert folded.isascii()
+        assert normalize_text(folded) == folded
+
+
+def test_tokenize_splits_on_non_alphanumerics():
+    assert tokenize('Caferağa Mah. Moda Cad. No:12/3') == ['caferaga', 'mah', 'moda', 'cad', 'no', '12', '3']
+    assert tokenize('') == []
+
+
+def test_search_keys_tokens_are_unique_and_in_field_order():
+    keys = search_keys({'name': 'Kadıköy Şube', 'address': 'Moda Cad. Kadıköy', 'city': 'İstanbul',
+                        'district': 'Kadıköy', 'company': 'PTT Kargo'})
+    assert keys['name'] == 'kadikoy sube'
+    assert keys['tokens'] == ['kadikoy', 'sube', 'moda', 'cad', 'istanbul', 'ptt', 'kargo']
@@ -0,0 +1,95 @@
+import random
+
+import pytest
+
+from search_keys import normalize_text
+from suggest_index import KIND_ORDER, SCAN_LIMIT, SuggestIndex
+
+NAMES = ['Kadıköy', 'Kartal', 'Karşıyaka', 'Moda', 'Merkez', 'Beşiktaş', 'Bağcılar', 'Şişli', 'Çankaya',
+         'Kızılay', 'Konak', 'Atatürk', 'Acıbadem', 'Ataşehir', 'Alsancak', 'Bornova', 'Buca']
+CITIES = ['İstanbul', 'Ankara', 'İzmir', 'Adana', 'Antalya', 'Aydın']
+COMPANIES = ['Aras Kargo', 'Akbaş Kargo', 'PTT Kargo', 'Kolay Gelsin', 'Yurtiçi Kargo']
+
+
+def make_docs(n: int, seed: int) -> list:
+    rng = random.Random(seed)
+    return [{
+        '_id': f'{i:05d}',
+        'name': ' '.join(rng.sample(NAMES, rng.randint(1, 3))) + f' {i}',
+        'city': rng.choice(CITIES),
+        'district': rng.choice(NAMES),
+        'company': rng.choice(COMPANIES),
+    } for i in range(n)]
+
+
+def brute_entries(docs: list) -> list:
+    """(kind, folded text, payload text, count) of every distinct suggestion"""
+    groups = {}
+    for doc in docs:
+        for kind, text, scope in (('company', doc['company'], ''), ('city', doc['city'], ''),
+                                  ('district', doc['district'], normalize_text(doc['city'])),
+                                  ('branch', doc['name'], doc['_id'])):
+            key = (kind, normalize_text(text), scope)
+            groups[key] = groups.get(key, 0) + 1
+    return [(kind, folded, count) for (kind, folded, _), count in groups.items()]
+
+
+def brute_phrase(entries: list, query: str, limit: int) -> list:
+    """Best suggestions whose folded text has a word starting with query"""
+    ranked = []
+    for kind, folded, count in entries:
+        words = folded.split(' ')
+        starts = [i for i in range(len(words)) if ' '.join(words[i:]).startswith(query)]
+        if starts:
+            ranked.append(((starts[0] > 0, KIND_ORDER.index(kind), -count, folded), kind, folded, count))
+    ranked.sort()
+    return [(kind, folded, count) for _, kind, folded, count in ranked[:limit]]
+
+
+@pytest.fixture(scope='module')
+def corpus():
+    docs = make_docs(1500, seed=11)
+    return brute_entries(docs), SuggestIndex(docs)
+
+
+def view(suggestions: list) -> list:
+    return [(s['type'], normalize_text(s['text']), s['count']) for s in suggestions]
+
+
+def test_suggestions_match_brute_force_ranking(corpus):
+    entries, index = corpus
+    rng = random.Random(12)
+    queries = ['a', 'k', 'ka', 'kad', 'istanbul', 'aras k', 'kadikoy mo', 'zz', '1', '12']
+    queries += [normalize_text(rng.choice(NAMES + CITIES + COMPANIES))[:rng.randint(1, 6)] for _ in range(200)]
+    for query in queries:
+        limit = rng.randint(1, 20)
+        expected = brute_phrase(entries, normalize_text(query), limit)
+        got = view(index.suggest(query, limit))
+        if len(query.split()) == 1 or len(expected) == limit:
+            assert got == expected, query
+        else:
+            assert got[:len(expected)] == expected, query
+
+
+def test_large_prefix_ranges_use_precomputed_lists(corpus):
+    _, index = corpus
+    assert any(len(p) == 1 for p in index._top)
+    lo, hi = index._range('a')
+    assert hi - lo > SCAN_LIMIT
+
+
+def test_words_in_any_order_fill_the_remaining_slots(corpus):
+    entries, index = corpus
+    for query in ('moda kadikoy', 'kargo aras', 'besiktas 7'):
+        words = query.split()
+        got = view(index.suggest(query, 20))
+        assert got[:len(brute_phrase(entries, query, 20))] == brute_phrase(entries, query, 20)
+        for kind, folded, _ in got:
+            text = ' ' + folded
+            assert all(' ' + w in text for w in words), (query, folded)
+
+
+def test_empty_query_has_no_suggestions(corpus):
+    _, index = corpus
+    assert index.suggest('') == []
+    assert index.suggest('   ') == []